@@ -0,0 +1,124 @@
+"""
+Compact storage of the derivations found by Proof.enumerate
+"""
+
+from array import array
+
+class BacktrackTable(object):
+    """
+    Maps terms to the list of their derivations (lhs,rhs,i,j,k,l),
+    like a defaultdict(list) would, but stores them compactly:
+    terms are given dense integer ids, and each derivation is a row
+    in a set of arrays (term id, lhs id, rhs id, i, j, k, l).
+
+    The rows of a term are chained together, so that they can be
+    read back in the order they were added.
+    """
+    def __init__(self):
+        # id -> term, and term -> id
+        self.terms = []
+        self.ids = {}
+        # columns of the rows
+        self.term_col = array('i')
+        self.lhs_col = array('i')
+        self.rhs_col = array('i')
+        self.coords_cols = tuple(array('H') for _ in range(4))
+        # for each row, the index of the next row of the same term (or -1)
+        self.next_row = array('i')
+        # for each term id, its first and last rows (or -1)
+        self.first_row = array('i')
+        self.last_row = array('i')
+
+    def term_id(self, term):
+        """
+        Returns the id of a term, allocating one if needed
+        """
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.terms.append(term)
+            self.ids[term] = term_id
+            self.first_row.append(-1)
+            self.last_row.append(-1)
+        return term_id
+
+    def add(self, term, lhs, rhs, i, j, k, l):
+        """
+        Adds a derivation of term, after the existing ones
+        """
+        term_id = self.term_id(term)
+        row = len(self.term_col)
+        self.term_col.append(term_id)
+        self.lhs_col.append(self.term_id(lhs))
+        self.rhs_col.append(self.term_id(rhs))
+        for col, coord in zip(self.coords_cols, (i,j,k,l)):
+            col.append(coord)
+        self.next_row.append(-1)
+        if self.first_row[term_id] == -1:
+            self.first_row[term_id] = row
+        else:
+            self.next_row[self.last_row[term_id]] = row
+        self.last_row[term_id] = row
+
+    def extend(self, term, lhs, rhs, coords):
+        """
+        Adds derivations of term from lhs and rhs,
+        one for each tuple (i,j,k,l) in coords.
+        """
+        for i,j,k,l in coords:
+            self.add(term, lhs, rhs, i, j, k, l)
+
+    def rows(self, term):
+        """
+        Generates the rows of the derivations of a term, as tuples
+        (lhs_id, rhs_id, i, j, k, l).
+        """
+        term_id = self.ids.get(term)
+        row = -1 if term_id is None else self.first_row[term_id]
+        i_col, j_col, k_col, l_col = self.coords_cols
+        while row != -1:
+            yield (self.lhs_col[row], self.rhs_col[row],
+                   i_col[row], j_col[row], k_col[row], l_col[row])
+            row = self.next_row[row]
+
+    def derivations(self, term):
+        """
+        Generates the derivations of a term, as tuples (lhs,rhs,i,j,k,l)
+        """
+        for lhs_id, rhs_id, i, j, k, l in self.rows(term):
+            yield (self.terms[lhs_id], self.terms[rhs_id], i, j, k, l)
+
+    def clear_rows(self):
+        """
+        Forgets all the derivations, but keeps the term ids
+        """
+        for col in (self.term_col, self.lhs_col, self.rhs_col, self.next_row) + self.coords_cols:
+            del col[:]
+        self.first_row = array('i', [-1]) * len(self.terms)
+        self.last_row = array('i', [-1]) * len(self.terms)
+
+    def __getitem__(self, term):
+        return list(self.derivations(term))
+
+    def __contains__(self, term):
+        term_id = self.ids.get(term)
+        return term_id is not None and self.first_row[term_id] != -1
+
+    def __iter__(self):
+        """
+        Iterates over the terms which have derivations,
+        in the order their first derivation was added.
+        """
+        first_rows = sorted(
+            (row, term_id)
+            for term_id, row in enumerate(self.first_row)
+            if row != -1)
+        for _, term_id in first_rows:
+            yield self.terms[term_id]
+
+    def __len__(self):
+        return sum(1 for row in self.first_row if row != -1)
+
+    def items(self):
+        for term in self:
+            yield (term, self[term])
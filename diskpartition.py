@@ -19,6 +19,25 @@ class DiskPartition(object):
         b_idx = self.nodes_order.index(b)
         return (min(a_idx, b_idx), max(a_idx, b_idx))
 
+    def crosses(self, link):
+        """
+        Does this link cross any link of the partition?
+        Adding it keeps a planar partition planar otherwise.
+
+        >>> DiskPartition([(0,2)], [0,1,2,3]).crosses((1,3))
+        True
+        >>> DiskPartition([(0,2)], [0,1,2,3]).crosses((2,3))
+        False
+        >>> DiskPartition([(1,6),(2,4)], list(range(8))).crosses((3,7))
+        True
+        """
+        u, v = self.to_idx_pair(link)
+        for other in self.links:
+            a, b = self.to_idx_pair(other)
+            if a < u < b < v or u < a < v < b:
+                return True
+        return False
+
     def is_planar(self):
         """
         Is this disk partition planar?
@@ -0,0 +1,147 @@
+"""
+On-disk storage of the levels computed by Proof.enumerate,
+so that enumerations can be resumed and their results reused.
+"""
+
+import json
+import os
+
+from rbgraph import RBG, B, r
+
+class LevelStore(object):
+    """
+    A directory holding the levels of an enumeration.
+
+    For each level m (the number of merges), two JSON files are written:
+    - level-m.terms.json: the terms first reached at this level,
+      as pairs [encoding, number of derivations];
+    - level-m.backtrack.json: for each of these terms, in the same order,
+      the list of its derivations [lhs_level, lhs_index, rhs_level, rhs_index, i, j, k, l],
+      where lhs and rhs are referred to by their level and index in that level.
+
+    Level 0 only contains B(r) and is not stored. A level is complete
+    once its backtrack file exists.
+    """
+    def __init__(self, path):
+        """
+        :param path: the directory of the store, created if needed
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, level, kind):
+        return os.path.join(self.path, 'level-{}.{}.json'.format(level, kind))
+
+    def _write(self, level, kind, content):
+        fname = self._file(level, kind)
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.replace(fname + '.tmp', fname)
+
+    def _read(self, level, kind):
+        with open(self._file(level, kind)) as f:
+            return json.load(f)
+
+    def completed_levels(self):
+        """
+        Number of consecutive levels, starting from 1, stored completely
+        """
+        level = 0
+        while os.path.exists(self._file(level + 1, 'backtrack')):
+            level += 1
+        return level
+
+    def save_level(self, level, reachable, backtrack, positions):
+        """
+        Stores a level.
+
+        :param reachable: dict of the terms first reached at this level to their counts
+        :param backtrack: maps each of these terms to its list of (lhs,rhs,i,j,k,l)
+        :param positions: maps all terms of the previous levels to their
+            (level, index) pair
+        """
+        self._write(level, 'terms', [
+            [term.encoding(), count]
+            for term, count in reachable.items()
+        ])
+        self._write(level, 'backtrack', [
+            [list(positions[lhs] + positions[rhs]) + [i,j,k,l]
+             for lhs,rhs,i,j,k,l in backtrack[term]]
+            for term in reachable
+        ])
+
+    def load_terms(self, level):
+        """
+        Returns the dict of terms first reached at this level to their counts
+        """
+        if level == 0:
+            return {B(r):1}
+        return {
+            RBG.from_encoding(encoding): count
+            for encoding, count in self._read(level, 'terms')
+        }
+
+    def load_backtrack(self, level, terms):
+        """
+        Returns the derivations of the terms first reached at this level,
+        as a list of lists of (lhs,rhs,i,j,k,l), in the order of the terms.
+
+        :param terms: for each level up to this one, the list of its terms
+        """
+        return [
+            [(terms[lhs_level][lhs_idx], terms[rhs_level][rhs_idx], i, j, k, l)
+             for lhs_level, lhs_idx, rhs_level, rhs_idx, i, j, k, l in derivations]
+            for derivations in self._read(level, 'backtrack')
+        ]
+
+    def backtrack(self, limit=None):
+        """
+        Returns a backtrack table backed by this store, which only
+        loads the derivations of a level when one of its terms is looked up.
+
+        :param limit: the number of levels to expose (by default, all the completed ones)
+        """
+        return StoredBacktrack(self, limit)
+
+
+class StoredBacktrack(object):
+    """
+    A read-only backtrack table (term -> list of (lhs,rhs,i,j,k,l))
+    loading its levels lazily from a LevelStore.
+    Like the table returned by Proof.enumerate, unknown terms
+    have no derivations.
+    """
+    def __init__(self, store, limit=None):
+        completed = store.completed_levels()
+        self.store = store
+        self.levels = completed if limit is None else min(limit, completed)
+        self.terms = [list(store.load_terms(level)) for level in range(self.levels + 1)]
+        self.positions = {
+            term: (level, idx)
+            for level, terms in enumerate(self.terms)
+            for idx, term in enumerate(terms)
+            if level > 0
+        }
+        self.loaded = {}
+
+    def __getitem__(self, term):
+        position = self.positions.get(term)
+        if position is None:
+            return []
+        level, idx = position
+        if level not in self.loaded:
+            self.loaded[level] = self.store.load_backtrack(level, self.terms)
+        return self.loaded[level][idx]
+
+    def __contains__(self, term):
+        return term in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def items(self):
+        for term in self:
+            yield (term, self[term])
@@ -1,6 +1,13 @@
+import json
+import os
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from itertools import islice
+
 from diskpartition import DiskPartition
 from formula import Bot, Top, Tens, Parr
+from unionfind import UnionFind
 
 class Linking(object):
     """
@@ -60,12 +67,91 @@ class Linking(object):
         disk = DiskPartition(self.links)
         return disk.is_planar()
 
-    def is_symmetric_proof(self):
-        from switching import Switching
-        return all(
-            switch.acyclic_and_connected()
-            for switch in Switching.enumerate(self)
-        )
+    def is_symmetric_proof(self, exhaustive=False):
+        """
+        Is every switching of this linking acyclic and connected?
+
+        This is decided by contracting the graph of the linking
+        (see contract), which is polynomial.
+
+        :param exhaustive: if True, walk on every switching instead
+            (exponential in the number of Parrs)
+        """
+        if exhaustive:
+            from switching import Switching
+            return all(
+                switch.acyclic_and_connected()
+                for switch in Switching.enumerate(self)
+            )
+        return self.contract() == 1
+
+    def contract(self):
+        """
+        Contracts the graph of this linking, whose vertices are the
+        subformulae and whose edges are the links and the edges of
+        the syntax tree. The two premise edges of a Parr are paired:
+        a switching keeps only one of them.
+
+        An unpaired edge is contracted, and so is a pair once both of its
+        edges join the same two vertices (Danos' contraction criterion).
+        Every switching is acyclic and connected if and only if
+        this ends with a single vertex.
+
+        Returns the number of vertices left, or None as soon as an edge
+        becomes a loop, which means that some switching has a cycle.
+        """
+        classes, premises, has_cycle = self.static_contraction()
+        if has_cycle:
+            return None
+
+        pairs = [(parr, left, right) for parr, (left, right) in premises.items()]
+        contracted = True
+        while pairs and contracted:
+            contracted = False
+            remaining = []
+            for parr, left, right in pairs:
+                root, root_left, root_right = (
+                    classes.find(parr), classes.find(left), classes.find(right))
+                if root in (root_left, root_right):
+                    return None
+                if root_left == root_right:
+                    classes.union(root, root_left)
+                    contracted = True
+                else:
+                    remaining.append((parr, left, right))
+            pairs = remaining
+        return classes.nb_classes
+
+    def static_contraction(self, parent_map=None):
+        """
+        Contracts the edges of the graph of this linking which are in
+        every switching: the links, and the edges of the syntax tree
+        except the premises of Parrs.
+
+        Returns a triple (classes, premises, has_cycle): the UnionFind
+        of the subformulae joined by these edges, a dict mapping each Parr
+        to the list of its two premises, and whether these edges
+        already make a cycle.
+
+        :param parent_map: the parent map of the formula, if already computed
+        """
+        subformulae = list(self.formula)
+        if parent_map is None:
+            parent_map = self.formula.parent_map()
+        classes = UnionFind(len(subformulae))
+        premises = defaultdict(list)
+        edges = list(self.links)
+        for child, parent in parent_map.items():
+            if isinstance(subformulae[parent], Parr):
+                premises[parent].append(child)
+            else:
+                edges.append((child, parent))
+
+        has_cycle = False
+        for a, b in edges:
+            if not classes.union(a, b):
+                has_cycle = True
+        return classes, premises, has_cycle
 
     def is_neighbour(self, other):
         """
@@ -78,9 +164,17 @@ class Linking(object):
         return self.strongly_planar() and self.is_symmetric_proof()
 
     @classmethod
-    def enumerate(cls, formula):
+    def enumerate(cls, formula, planar=False, acyclic=False, limit=None):
         """
-        Generates all the valid linkings for a formula
+        Generates all the valid linkings for a formula,
+        linking each bottom to a top in turn.
+
+        :param planar: only generate strongly planar linkings, pruning
+            as soon as a link crosses the previous ones
+        :param acyclic: only generate linkings whose switchings are all
+            acyclic, pruning as soon as the links chosen so far make a
+            cycle in some switching
+        :param limit: stop after generating that many linkings
         """
         formula.cache_subformulae()
         bot_indices = list(
@@ -95,68 +189,179 @@ class Linking(object):
             if isinstance(subformula, Top)
         )
 
-        # Generate the exponential of the set
-        l = len(bot_indices)
-        k = len(top_indices)
-        bound = pow(k,l)
-        for i in range(bound):
-            remainder = i
-            dct = {}
-            for j in range(l):
-                dct[bot_indices[j]] = top_indices[remainder % k]
-                remainder = remainder // k
-            yield cls(formula, list(dct.items()))
+        disk = DiskPartition([], sorted(bot_indices + top_indices))
+        links = disk.links
+        def extend(position):
+            if position == len(bot_indices):
+                yield cls(formula, list(links))
+                return
+            bot = bot_indices[position]
+            for top in top_indices:
+                if planar and disk.crosses((bot, top)):
+                    continue
+                links.append((bot, top))
+                if not acyclic or cls(formula, links).contract() is not None:
+                    yield from extend(position + 1)
+                links.pop()
+
+        yield from islice(extend(0), limit)
 
     @classmethod
-    def enumerate_symmetric_proofs(cls, formula):
-        return (
+    def enumerate_symmetric_proofs(cls, formula, limit=None):
+        return islice((
             linking
-            for linking in cls.enumerate(formula)
+            for linking in cls.enumerate(formula, acyclic=True)
             if linking.is_symmetric_proof()
-        )
+        ), limit)
 
     @classmethod
-    def enumerate_cyclic_proofs(cls, formula):
-        return (
+    def enumerate_cyclic_proofs(cls, formula, limit=None):
+        return islice((
             linking
-            for linking in cls.enumerate(formula)
-            if linking.is_cyclic_proof()
-        )
+            for linking in cls.enumerate(formula, planar=True, acyclic=True)
+            if linking.is_symmetric_proof()
+        ), limit)
+
+    @staticmethod
+    def neighbour_pairs(linkings):
+        """
+        Generates the pairs (i, j), with j < i, of indices of linkings
+        which are neighbours, assuming that they are distinct
+        and all list their links in the same order of bottoms.
+
+        Two such linkings are neighbours when they become equal
+        once the same link is removed from both: they are found
+        by indexing the linkings by each link they can lose.
+        """
+        signatures = defaultdict(list)
+        for idx, linking in enumerate(linkings):
+            links = linking.links
+            for position in range(len(links)):
+                signature = (position, tuple(links[:position]), tuple(links[position+1:]))
+                for other in signatures[signature]:
+                    yield (idx, other)
+                signatures[signature].append(idx)
+
+    @staticmethod
+    def count_components(nb_vertices, edges):
+        """
+        Number of connected components of a graph, by union-find
+
+        >>> Linking.count_components(4, [(1, 0), (3, 2), (2, 1)])
+        1
+        >>> Linking.count_components(3, [(2, 0)])
+        2
+        """
+        classes = UnionFind(nb_vertices)
+        for i, j in edges:
+            classes.union(i, j)
+        return classes.nb_classes
 
     @classmethod
-    def graph_of_equivalences(cls, formula, fname):
+    def graph_of_equivalences(cls, formula, fname=None):
+        """
+        Returns the number of cyclic proofs of a formula and the number
+        of connected components of the graph of their rewirings,
+        or (0, 0) if there is at most one proof.
+
+        :param fname: if provided, the graph is rendered with graphviz
+            to networks/fname.png
+        """
         proofs = list(cls.enumerate_cyclic_proofs(formula))
         if len(proofs) <= 1:
             return (0, 0)
 
-        # we do a union-find to keep track of the connected components
-        parent = list(range(len(proofs)))
-        def find(i):
-            if parent[i] == i:
-                return i
-            parent[i] = find(parent[i])
-            return parent[i]
-
-        def merge(i, j):
-            pi = find(i)
-            pj = find(j)
-            parent[pi] = pj
-
-        import graphviz as gv
-        g = gv.Graph()
-        for idx, p in enumerate(proofs):
-            g.node(str(idx), label=str(idx))
-            for idx2 in range(idx):
-                q = proofs[idx2]
-                if p.is_neighbour(q):
-                    g.edge(str(idx), str(idx2))
-                    merge(idx, idx2)
-        # g.format = 'png'
-        # g.render(filename='networks/'+fname)
-
-        # count connected components
-        cc = len(set(find(i) for i in range(len(proofs))))
-        return (len(proofs), cc)
+        edges = list(cls.neighbour_pairs(proofs))
+        if fname is not None:
+            import graphviz as gv
+            g = gv.Graph()
+            for idx in range(len(proofs)):
+                g.node(str(idx), label=str(idx))
+            for idx, idx2 in edges:
+                g.edge(str(idx), str(idx2))
+            g.format = 'png'
+            g.render(filename='networks/'+fname)
+
+        return (len(proofs), cls.count_components(len(proofs), edges))
+
+def sweep(start, end, workers=None, done=()):
+    """
+    Counts the cyclic proofs of all the provable normalized formulae
+    with a number of nodes in range(start, end, 2), and the connected
+    components of the graph of their rewirings (see graph_of_equivalences),
+    generating a record for each formula as soon as it is computed:
+    {"nodes", "index", "formula", "proofs", "components", "seconds"},
+    where index is the position of the formula in Parr.enumerate_normalized.
+
+    :param workers: if provided, the formulae are distributed across
+        a pool of that many processes, and records come in completion order
+    :param done: the (nodes, index) pairs of the formulae to skip
+    """
+    formulae = (
+        (nb_nodes, idx, formula)
+        for nb_nodes in range(start, end, 2)
+        for idx, formula in enumerate(Parr.enumerate_normalized(nb_nodes))
+        if (nb_nodes, idx) not in done and formula.valuation() == 1
+    )
+    if not workers:
+        for task in formulae:
+            yield _sweep_formula(task)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        # only keep a few formulae per worker in flight
+        pending = set()
+        for task in formulae:
+            pending.add(executor.submit(_sweep_formula, task))
+            if len(pending) >= 4 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+def sweep_to_file(fname, start, end, workers=None, resume=False):
+    """
+    Writes the records of sweep to a file, one JSON object per line,
+    flushing each of them.
+
+    :param resume: if True, skips the formulae already recorded in
+        the file and appends to it
+    """
+    done = set()
+    if resume and os.path.exists(fname):
+        # end of the last complete line, after which a line may have been
+        # cut by an interrupted sweep
+        end_of_records = 0
+        with open(fname, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                end_of_records += len(line)
+                record = json.loads(line)
+                done.add((record['nodes'], record['index']))
+        os.truncate(fname, end_of_records)
+    with open(fname, 'a' if resume else 'w') as f:
+        for record in sweep(start, end, workers=workers, done=done):
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+
+def _sweep_formula(task):
+    """
+    Computes the record of a formula for sweep
+    """
+    nb_nodes, idx, formula = task
+    start_time = time.perf_counter()
+    proofs = list(Linking.enumerate_cyclic_proofs(formula))
+    cc = Linking.count_components(len(proofs), Linking.neighbour_pairs(proofs))
+    return {
+        'nodes': nb_nodes,
+        'index': idx,
+        'formula': str(formula),
+        'proofs': len(proofs),
+        'components': cc,
+        'seconds': time.perf_counter() - start_time,
+    }
 
 if __name__ == '__main__':
 
@@ -166,28 +371,35 @@ if __name__ == '__main__':
         f = Parr(Top(), Parr(Tens(Bot(), Bot()), Parr(Top(), Parr(Tens(Bot(), Bot()), Top()))))
         for linking in Linking.enumerate_cyclic_proofs(f):
             print(linking.links)
-        cc = Linking.graph_of_equivalences(f, 'hh')
+        cc = Linking.graph_of_equivalences(f)
         print(cc)
         print('triple unit')
         triple_unit = Parr(Parr(Tens(Parr(Tens(Bot(),Bot()),Top()),Bot()), Top()), Tens(Bot(), Parr(Top(), Top())))
         for linking in Linking.enumerate_cyclic_proofs(triple_unit):
             print(linking.links)
-        cc = Linking.graph_of_equivalences(triple_unit, 'triple')
+        cc = Linking.graph_of_equivalences(triple_unit)
         print(cc)
         print('three proofs')
         gadget = Parr(Top(), Parr(Top(),Tens(Bot(), Bot())))
         three_proofs = Tens(gadget, gadget)
         for linking in Linking.enumerate_cyclic_proofs(three_proofs):
             print(linking.links)
-        cc = Linking.graph_of_equivalences(three_proofs, 'three_proofs')
+        cc = Linking.graph_of_equivalences(three_proofs)
     else:
-        start = int(sys.argv[1])
-        end = int(sys.argv[2])
-
-        for nb_nodes in range(start,end,2):
-            print('all provable normalized formulae with {} nodes and more than one proof'.format(nb_nodes))
-            for idx, formula in enumerate(Parr.enumerate_normalized(nb_nodes)):
-                if (formula.valuation() == 1):
-                    nb_proofs, cc = Linking.graph_of_equivalences(formula, 'enumerate-{}-{}'.format(nb_nodes, idx))
-                    if cc:
-                        print('{} {} {} ({})'.format(formula, nb_proofs, cc, idx))
+        import argparse
+        parser = argparse.ArgumentParser(
+            description='Graphs of equivalences of all provable normalized formulae')
+        parser.add_argument('start', type=int, help='smallest number of nodes')
+        parser.add_argument('end', type=int, help='bound on the number of nodes (excluded)')
+        parser.add_argument('--output', help='JSONL file to write the records to (default: stdout)')
+        parser.add_argument('--workers', type=int, help='number of processes')
+        parser.add_argument('--resume', action='store_true',
+                            help='skip the formulae already recorded in the output')
+        args = parser.parse_args()
+
+        if args.output:
+            sweep_to_file(args.output, args.start, args.end,
+                          workers=args.workers, resume=args.resume)
+        else:
+            for record in sweep(args.start, args.end, workers=args.workers):
+                print(json.dumps(record), flush=True)
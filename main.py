@@ -20,10 +20,8 @@ if __name__ == '__main__':
     pspace = B(R(b,b),r,r,r,R(b,b))
     four = B(R(b,b),r,r,R(b,b),r)
     backtrack = Proof.enumerate(int(sys.argv[1]))
-    proofs = Proof.reconstruct((), triple_unit, Proof(), backtrack)
-    proofs = list(proofs)
-    a = proofs[0].remove_unit_intros()
-    b = proofs[1].remove_unit_intros()
+    a = Proof.nth(triple_unit, 0, backtrack).remove_unit_intros()
+    b = Proof.nth(triple_unit, 1, backtrack).remove_unit_intros()
     path = b.equivalence_path(a)
     print_proofs(path, 'equivalence')
 
@@ -1,7 +1,13 @@
-from hashable_collections.hashable_collections import hashable_list
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import heapq
+import random
+import time
 
 from proofstep import UnitAxiom, MergeStep
+from levelstore import LevelStore
+from backtrack import BacktrackTable
+from pvector import PersistentVector
 from rbgraph import B, r
 
 class Proof(object):
@@ -16,7 +22,17 @@ class Proof(object):
             representing the initial proof state.
         """
         self.hyp = hypotheses
-        self.steps = hashable_list()
+        self.steps = PersistentVector()
+
+    @property
+    def hyp(self):
+        return self._hyp
+
+    @hyp.setter
+    def hyp(self, hypotheses):
+        self._hyp = hypotheses
+        # hash of the hypotheses, computed when first needed
+        self._hyp_hash = None
 
     @property
     def hypotheses(self):
@@ -46,7 +62,7 @@ class Proof(object):
         """
         Add a proof step at the end of the current proof.
         """
-        self.steps.append(step)
+        self.steps = self.steps.append(step)
 
     def hypotheses_at_index(self, i):
         """
@@ -59,35 +75,49 @@ class Proof(object):
         Moves all the unit introductions to the top and returns
         the proof starting when all units have been introduced.
         """
-
-        # First, lift all the units to the top, bubble-sort style
-        merge_unit_found = True
-        current_proof = self.copy()
-        while merge_unit_found:
-            merge_unit_found = False
-            first_merge_index = len(self)
-            for i in range(len(current_proof.steps)-1):
-                a = current_proof.steps[i]
-                b = current_proof.steps[i+1]
-                if isinstance(a, MergeStep) and isinstance(b, UnitAxiom):
-                    merge_unit_found = True
-                    commutation = list(b.commutes_with_previous(a,
-                            current_proof.hypotheses_at_index(i)))
-                    newa, newb = commutation[0]
-                    current_proof.steps[i] = newa
-                    current_proof.steps[i+1] = newb
-
-                # maintain the index of the first merge found
-                if isinstance(a, MergeStep):
-                    first_merge_index = min(first_merge_index, i)
-                elif isinstance(b, MergeStep):
-                    first_merge_index = min(first_merge_index, i+1)
-
-        # Then, remove them
-        new_hyp = current_proof.hypotheses_at_index(first_merge_index)
-        current_proof.steps = hashable_list(current_proof.steps[first_merge_index:])
-        current_proof.hyp = new_hyp
-        return current_proof
+        # Units are only ever introduced between terms, so each term is a
+        # block of consecutive leaves (hypotheses and units) in the order
+        # they have once all units are introduced. First, find that order,
+        # chaining the leaves of each block.
+        leaves = list(self.hyp)
+        following = [None] * len(leaves)
+        blocks = [(leaf, leaf) for leaf in range(len(leaves))]
+        for step in self.steps:
+            p = step.position
+            if isinstance(step, UnitAxiom):
+                leaves.append(step.terms[p])
+                following.append(None)
+                blocks.insert(p, (len(leaves)-1, len(leaves)-1))
+            else:
+                (first, lhs_last), (rhs_first, last) = blocks[p], blocks[p+1]
+                following[lhs_last] = rhs_first
+                blocks[p:p+2] = [(first, last)]
+        order = []
+        for leaf, _ in blocks:
+            while leaf is not None:
+                order.append(leaf)
+                leaf = following[leaf]
+
+        # Then, replay the merges on all the leaves, reusing the merged graphs.
+        # Terms are identified by their first leaf, in the original proof
+        # and in the new one.
+        terms = tuple(leaves[leaf] for leaf in order)
+        new_proof = Proof(terms)
+        original_terms = list(range(len(self.hyp)))
+        new_terms = order
+        nb_leaves = len(self.hyp)
+        for step in self.steps:
+            p = step.position
+            if isinstance(step, UnitAxiom):
+                original_terms.insert(p, nb_leaves)
+                nb_leaves += 1
+            else:
+                q = new_terms.index(original_terms[p])
+                del original_terms[p+1]
+                del new_terms[q+1]
+                terms = terms[:q] + (step.terms[p],) + terms[q+2:]
+                new_proof.add_step(MergeStep(terms, q, step.coords))
+        return new_proof
 
     def neighbours(self):
         """
@@ -101,47 +131,195 @@ class Proof(object):
             for commutation in second.commutes_with_previous(first, parent):
                 [first,second] = commutation
                 new_proof = self.copy()
-                new_proof.steps[i] = first.copy()
-                new_proof.steps[i+1] = second.copy()
+                new_proof.steps = self.steps.set(i, first.copy()).set(i+1, second.copy())
                 yield new_proof
 
-    def equivalence_class(self, seen=None):
+    def equivalence_class(self, seen=None, max_proofs=None, max_seen=None, timeout=None):
         """
         Returns a generator of the equivalence class
-        of the current proof
+        of the current proof, explored depth-first.
+
+        The exploration stops early once max_proofs proofs have been
+        generated, once max_seen proofs have been recorded in the seen set,
+        or after timeout seconds.
         """
         if seen is None:
             seen = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        def exhausted(nb_proofs):
+            return ((max_proofs is not None and nb_proofs >= max_proofs) or
+                    (max_seen is not None and len(seen) >= max_seen) or
+                    (deadline is not None and time.monotonic() >= deadline))
+
+        if exhausted(0):
+            return
         seen.add(self)
         yield self
-        for step in self.neighbours():
-            if step in seen:
-                continue
-            yield from step.equivalence_class(seen=seen)
+        nb_proofs = 1
+        # the neighbours still to explore, for each proof on the current path
+        stack = [self.neighbours()]
+        while stack and not exhausted(nb_proofs):
+            proof = next(stack[-1], None)
+            if proof is None:
+                stack.pop()
+            elif proof not in seen:
+                seen.add(proof)
+                yield proof
+                nb_proofs += 1
+                stack.append(proof.neighbours())
+
+    def equivalent(self, other, index=None):
+        """
+        Returns a boolean: are these two proofs equivalent, that is,
+        can each of them be reached from the other by commutations?
+        (Commutations cannot always be reversed.)
 
-    def equivalent(self, other):
+        :param index: if provided, the proofs are compared through their
+            canonical forms, using (and filling) this index (see canonical_form).
+        """
+        if index is not None:
+            return self.canonical_form(index) == other.canonical_form(index)
+        return other in self.equivalence_class() and self in other.equivalence_class()
+
+    def canonical_form(self, index=None):
+        """
+        Returns the canonical representative of the equivalence class
+        of this proof (see equivalent): its member with the smallest sort_key.
+        Two proofs are equivalent if and only if they have the same
+        canonical form.
+
+        :param index: a dict mapping proofs to their canonical forms.
+            The first call for a class records all of its members, and those
+            of the classes reachable from it, so that the canonical forms of
+            the others are then found in O(1).
         """
-        Returns a boolean: are these two proofs equivalent?
+        if index is None:
+            index = {}
+        if self not in index:
+            for members in _equivalence_classes(self, index):
+                canonical = min(members, key=Proof.sort_key)
+                for member in members:
+                    index.setdefault(member, canonical)
+        return index[self]
+
+    def sort_key(self):
         """
-        return other in self.equivalence_class()
+        A key ordering the proofs with the same hypotheses:
+        the sequence of kinds, positions and coordinates of the steps.
+        """
+        return tuple(
+            (0, step.position, ()) if isinstance(step, UnitAxiom)
+            else (1, step.position, step.coords)
+            for step in self.steps)
+
+    @classmethod
+    def partition(cls, proofs, max_explored=None):
+        """
+        Groups a stream of proofs into equivalence classes (see equivalent).
+
+        Each proof is explored at most once: the classes of the proofs
+        reachable from a proof of the stream are all recorded, and their
+        members are not explored again.
 
-    def equivalence_path(self, other, seen=None):
+        Returns a list of triples (representative, members, size), one per
+        class, in order of first appearance in the stream: the representative
+        is the first member, members the proofs of the stream in the class,
+        and size the number of proofs of the class.
+
+        :param max_explored: a budget of proofs to explore per exploration.
+            Classes are then only as fine as the explored proofs can tell:
+            equivalent proofs may be reported in different classes.
         """
-        Generates ane equivalence path from the other
-        to self
+        # explored proof -> index of its class
+        class_of = {}
+        sizes = []
+        stream = []
+        for proof in proofs:
+            stream.append(proof)
+            if proof in class_of:
+                continue
+            for members in _equivalence_classes(proof, class_of, max_explored):
+                for member in members:
+                    class_of[member] = len(sizes)
+                sizes.append(len(members))
+
+        classes = {}
+        for proof in stream:
+            classes.setdefault(class_of[proof], []).append(proof)
+        return [(members[0], members, sizes[c])
+                for c, members in classes.items()]
+
+    def equivalence_path(self, other, astar=False):
         """
-        if seen is None:
-            seen = set()
-        seen.add(self)
-        if other == self:
+        Returns a shortest equivalence path from the other
+        to self: a list of proofs starting with other and ending
+        with self, where each proof is a neighbour of the next one.
+        Returns None if the proofs are not equivalent.
+
+        By default, this runs a breadth-first search from both ends.
+        Commutations cannot always be reversed, so the search from the
+        other only follows the commutations which can, and the search from
+        self goes on alone once the other one is exhausted. The path is
+        then shortest among those whose part from the other only uses
+        reversible commutations.
+        If astar=True, runs an A* search from self instead,
+        guided by the number of steps which differ from the other.
+        """
+        if astar:
+            return self._astar_path(other)
+        if self == other:
             return [self]
-        for step in self.neighbours():
-            if step in seen:
+
+        # for each proof reached from self (resp. other),
+        # the neighbour it was reached from
+        forward = {self: None}
+        backward = {other: None}
+        forward_frontier = [self]
+        backward_frontier = [other]
+        while forward_frontier:
+            # expand the smallest frontier by one level
+            if backward_frontier and len(backward_frontier) < len(forward_frontier):
+                backward_frontier, meeting = _expand(
+                        backward_frontier, backward, forward, reverse=True)
+            else:
+                forward_frontier, meeting = _expand(forward_frontier, forward, backward)
+            if meeting is not None:
+                path = _chain(meeting, backward)
+                path.reverse()
+                return path + _chain(meeting, forward)[1:]
+        return None
+
+    def _astar_path(self, other):
+        """
+        A* variant of equivalence_path
+        """
+        if self.hyp != other.hyp or len(self) != len(other):
+            return None
+
+        def heuristic(proof):
+            # each commutation changes two steps at most
+            differing = sum(1 for a, b in zip(proof.steps, other.steps) if a != b)
+            return (differing + 1) // 2
+
+        parents = {self: None}
+        distances = {self: 0}
+        # entries are (estimated length, tie breaker, distance, proof)
+        queue = [(heuristic(self), 0, 0, self)]
+        tie_breaker = 1
+        while queue:
+            _, _, distance, proof = heapq.heappop(queue)
+            if distance > distances[proof]:
                 continue
-            path = step.equivalence_path(other, seen)
-            if path:
-                path.append(self)
-                return path
+            if proof == other:
+                return _chain(proof, parents)
+            for neighbour in proof.neighbours():
+                if distance + 1 < distances.get(neighbour, distance + 2):
+                    distances[neighbour] = distance + 1
+                    parents[neighbour] = proof
+                    heapq.heappush(queue, (distance + 1 + heuristic(neighbour),
+                                           tie_breaker, distance + 1, neighbour))
+                    tie_breaker += 1
+        return None
 
     def __repr__(self):
         return (
@@ -160,71 +338,280 @@ class Proof(object):
 
     def copy(self):
         new = Proof(self.hyp)
-        new.steps = hashable_list(self.steps[:])
+        new._hyp_hash = self._hyp_hash
+        # steps are immutable, so they can be shared
+        new.steps = self.steps
         return new
 
     def __hash__(self):
-        return hash((self.hyp,self.steps))
+        # the hash of the steps is maintained incrementally by
+        # the persistent vector, so this does not depend on the length
+        if self._hyp_hash is None:
+            self._hyp_hash = hash(self.hyp)
+        return hash((self._hyp_hash, self.steps))
 
     @classmethod
-    def enumerate(cls, limit):
+    def enumerate(cls, limit, workers=None, store=None, counts=False):
         """
         Enumerate all provable terms up to
         a certain proof depth
+
+        :param workers: if provided, the merges of each level are
+            computed by a pool of that many processes. The result
+            is the same as with a single process.
+        :param store: if provided, a LevelStore (or the path of one):
+            the levels it already contains are not recomputed, each new
+            level is saved to it once complete, and the backtrack table
+            returned is read lazily from it.
+        :param counts: if True, returns a pair (backtrack, reachable) where
+            reachable maps each number of merges m to a dict from the terms
+            first reached with m merges to their number of proofs.
         """
         reachable = {}
         reachable[0] = {B(r):1}
 
         all_reachables = {B(r)}
 
-        backtrack = defaultdict(list)
-        # structure of this dict:
+        backtrack = BacktrackTable()
+        # structure of this table:
         # term -> list of (lhs,rhs,i,j,k,l)
 
-        # fill each set of reacheable terms after m merges
-        for m in range(1,limit+1):
-            reachable[m] = {}
-            # select a previous number of merges for the LHS
-            for p in range(0,m):
-                # loop through existing proofs for the LHS
-                for lhs, num_lhs in reachable[p].items():
-                    # loop through existing proofs for the RHS
-                    for rhs, num_rhs in reachable[m-1-p].items():
-                        # loop through possible merges
-                        for term,i,j,k,l in lhs.possible_merges(rhs):
-                            new_term = term not in all_reachables
-                            if term in reachable[m]:
-                                reachable[m][term] += num_lhs * num_rhs
-                                backtrack[term]
-                            elif new_term:
-                                reachable[m][term] = num_lhs * num_rhs
-                                all_reachables.add(term)
-
-                            if term in reachable[m]:
-                                backtrack[term].append(
-                                    (lhs,rhs,i,j,k,l))
-
-            #print('------{}------'.format(m))
-            #for term, count in reachable[m].items():
-            #    if term == triple_unit:
-            #        print('triple unit:')
-            #    print('{}\t{}'.format(count,term))
+        first_level = 1
+        if store is not None:
+            if isinstance(store, str):
+                store = LevelStore(store)
+            first_level = min(store.completed_levels(), limit) + 1
+            for m in range(1, first_level):
+                reachable[m] = store.load_terms(m)
+                all_reachables.update(reachable[m])
+            # the (level, index) of each term, to refer to it in the store
+            positions = {
+                term: (m, idx)
+                for m in reachable
+                for idx, term in enumerate(reachable[m])
+            }
+
+        executor = ProcessPoolExecutor(workers) if workers else None
+        try:
+            # fill each set of reacheable terms after m merges
+            for m in range(first_level,limit+1):
+                reachable[m] = {}
+                # select a previous number of merges for the LHS,
+                # and loop through existing proofs for the LHS and RHS
+                pairs = [
+                    (lhs, num_lhs, rhs, num_rhs)
+                    for p in range(0,m)
+                    for lhs, num_lhs in reachable[p].items()
+                    for rhs, num_rhs in reachable[m-1-p].items()
+                ]
+                level_merges = _level_merges(
+                        [(lhs, rhs) for lhs, _, rhs, _ in pairs], executor, workers)
+                for (lhs, num_lhs, rhs, num_rhs), merges in zip(pairs, level_merges):
+                    # loop through possible merges
+                    for term, coords in merges:
+                        num_term = len(coords) * num_lhs * num_rhs
+                        new_term = term not in all_reachables
+                        if term in reachable[m]:
+                            reachable[m][term] += num_term
+                        elif new_term:
+                            reachable[m][term] = num_term
+                            all_reachables.add(term)
+
+                        if term in reachable[m]:
+                            backtrack.extend(term, lhs, rhs, coords)
+
+                if store is not None:
+                    store.save_level(m, reachable[m], backtrack, positions)
+                    for idx, term in enumerate(reachable[m]):
+                        positions[term] = (m, idx)
+                    backtrack.clear_rows()
+
+                #print('------{}------'.format(m))
+                #for term, count in reachable[m].items():
+                #    if term == triple_unit:
+                #        print('triple unit:')
+                #    print('{}\t{}'.format(count,term))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if store is not None:
+            backtrack = store.backtrack(limit)
+        if counts:
+            return (backtrack, reachable)
         return backtrack
 
     @classmethod
     def reconstruct(cls, left, term, proof_of_left, backtrack):
         """
-        Prints all proofs of a given term, at the context [left, X, right]
+        Generates all proofs of a given term, at the context [left, X, right]
+
+        The proofs of the subterms are computed only once for each
+        context they appear in, and are shared between the proofs using them.
         """
+        fragments = {}
+        context = proof_of_left.conclusion
+        position = len(left)
         if term == B(r):
-            yield proof_of_left.unit(len(left))
+            derivations = [(cls._fragments(context, position, term, backtrack, fragments)[0],)]
         else:
-            for lhs,rhs,i,j,k,l in backtrack[term]:
-                proofs_of_lhs = cls.reconstruct(left, lhs, proof_of_left.copy(), backtrack)
-                for proof_of_lhs in proofs_of_lhs:
-                    proofs_of_lhs_rhs = cls.reconstruct(left+(lhs,), rhs, proof_of_lhs, backtrack)
-                    for proof in proofs_of_lhs_rhs:
-                        yield proof.merge(len(left), (i,j,k,l))
+            derivations = cls._derivation_fragments(context, position, term, backtrack, fragments)
+        for fragment in derivations:
+            proof = proof_of_left.copy()
+            for steps in fragment:
+                for step in steps:
+                    proof.add_step(step)
+            yield proof
+
+    @classmethod
+    def _derivation_fragments(cls, context, position, term, backtrack, fragments):
+        """
+        Generates the proofs of term at the given position of context,
+        as triples (steps proving the lhs, steps proving the rhs, (merge step,))
+        """
+        for lhs,rhs,i,j,k,l in backtrack[term]:
+            for lhs_steps in cls._fragments(context, position, lhs, backtrack, fragments):
+                lhs_conclusion = lhs_steps[-1].terms
+                for rhs_steps in cls._fragments(lhs_conclusion, position+1, rhs, backtrack, fragments):
+                    merge = MergeStep.from_parent(rhs_steps[-1].terms, position, (i,j,k,l))
+                    yield (lhs_steps, rhs_steps, (merge,))
+
+    @classmethod
+    def _fragments(cls, context, position, term, backtrack, fragments):
+        """
+        Returns the list of all the sequences of steps proving term
+        at the given position of context (a tuple of graphs), in the order
+        of reconstruct. They are memoised in the fragments dict, along with
+        those of the subterms, which are computed first using an explicit stack.
+        """
+        def key(context, position, term):
+            # steps depend on the exact graphs of the context
+            return (tuple(map(id, context)), position, term)
+
+        root = key(context, position, term)
+        stack = [(context, position, term)]
+        while stack:
+            context, position, term = stack[-1]
+            if key(context, position, term) in fragments:
+                stack.pop()
+                continue
+
+            if term == B(r):
+                steps = [(UnitAxiom.from_parent(context, position),)]
+                fragments[key(context, position, term)] = (context, steps)
+                stack.pop()
+                continue
+
+            # make sure all the subterms are available
+            missing = []
+            derivations = backtrack[term]
+            for lhs,rhs,i,j,k,l in derivations:
+                lhs_key = key(context, position, lhs)
+                if lhs_key not in fragments:
+                    missing.append((context, position, lhs))
+                    continue
+                for lhs_steps in fragments[lhs_key][1]:
+                    lhs_conclusion = lhs_steps[-1].terms
+                    if key(lhs_conclusion, position+1, rhs) not in fragments:
+                        missing.append((lhs_conclusion, position+1, rhs))
+            if missing:
+                stack.extend(reversed(missing))
+                continue
+
+            stack.pop()
+            steps = [
+                lhs_steps + rhs_steps + merge
+                for lhs_steps, rhs_steps, merge in cls._derivation_fragments(
+                    context, position, term, backtrack, fragments)
+            ]
+            fragments[key(context, position, term)] = (context, steps)
+
+        return fragments[root][1]
+
+    @classmethod
+    def count(cls, term, backtrack, memo=None):
+        """
+        Number of proofs of a given term, as generated by reconstruct
+
+        :param memo: a dict caching, for each term, its derivations and
+            the cumulative numbers of proofs up to each of them, which can
+            be shared between calls with the same backtrack table.
+        """
+        if memo is None:
+            memo = {}
+        if term == B(r):
+            return 1
+        _, cumulative = cls._cumulative_counts(term, backtrack, memo)
+        return cumulative[-1] if cumulative else 0
+
+    @classmethod
+    def _cumulative_counts(cls, term, backtrack, memo):
+        """
+        Returns the list of derivations of a term, and the list of the
+        numbers of proofs of the derivations up to each of them
+        """
+        if term not in memo:
+            derivations = backtrack[term]
+            cumulative = []
+            total = 0
+            for lhs,rhs,i,j,k,l in derivations:
+                total += cls.count(lhs, backtrack, memo) * cls.count(rhs, backtrack, memo)
+                cumulative.append(total)
+            memo[term] = (derivations, cumulative)
+        return memo[term]
+
+    @classmethod
+    def nth(cls, term, index, backtrack, memo=None):
+        """
+        Returns the proof of a given term at the given index
+        in the order of reconstruct, without generating the previous ones.
+
+        :param memo: same as for count
+        """
+        if memo is None:
+            memo = {}
+        if not 0 <= index < cls.count(term, backtrack, memo):
+            raise IndexError('There are only {} proofs of {}'.format(
+                cls.count(term, backtrack, memo), term))
+        proof = Proof()
+        cls._unrank((), term, index, proof, backtrack, memo)
+        return proof
+
+    @classmethod
+    def sample(cls, term, backtrack, n, seed=None, memo=None):
+        """
+        Generates n proofs of a given term drawn uniformly at random
+        (with replacement) among the proofs generated by reconstruct.
+
+        :param seed: seed of the random generator, for reproducible samples
+        :param memo: same as for count
+        """
+        if memo is None:
+            memo = {}
+        rng = random.Random(seed)
+        nb_proofs = cls.count(term, backtrack, memo)
+        if not nb_proofs:
+            raise IndexError('There are only 0 proofs of {}'.format(term))
+        for _ in range(n):
+            yield cls.nth(term, rng.randrange(nb_proofs), backtrack, memo)
+
+    @classmethod
+    def _unrank(cls, left, term, index, proof, backtrack, memo):
+        """
+        Appends to the proof the steps of the proof of term
+        at the given index, at the context [left, X]
+        """
+        if term == B(r):
+            proof.unit(len(left))
+            return
+        derivations, cumulative = cls._cumulative_counts(term, backtrack, memo)
+        position = bisect.bisect_right(cumulative, index)
+        if position:
+            index -= cumulative[position-1]
+        lhs,rhs,i,j,k,l = derivations[position]
+        index_lhs, index_rhs = divmod(index, cls.count(rhs, backtrack, memo))
+        cls._unrank(left, lhs, index_lhs, proof, backtrack, memo)
+        cls._unrank(left+(lhs,), rhs, index_rhs, proof, backtrack, memo)
+        proof.merge(len(left), (i,j,k,l))
 
 
     def to_html(self):
@@ -240,3 +627,106 @@ class Proof(object):
         return html
 
 
+def _distinct_merges(pairs):
+    """
+    Lists the distinct merges of each pair of terms
+    """
+    return [list(lhs.possible_merges(rhs, distinct=True)) for lhs, rhs in pairs]
+
+def _level_merges(pairs, executor=None, workers=1):
+    """
+    Generates the distinct merges of each pair of terms, in order,
+    sharding the pairs across the executor if one is given.
+    """
+    if executor is None:
+        yield from _distinct_merges(pairs)
+        return
+    # a few chunks per worker, to balance the load
+    chunk_size = max(1, -(-len(pairs) // (4 * workers)))
+    chunks = [pairs[idx:idx+chunk_size] for idx in range(0, len(pairs), chunk_size)]
+    for chunk in executor.map(_distinct_merges, chunks):
+        yield from chunk
+
+def _expand(frontier, parents, other_parents, reverse=False):
+    """
+    Computes the next level of a breadth-first search, recording
+    the parent of each new proof. Returns the new frontier, and a proof
+    reached by the other search minimizing the length of the path
+    through it (or None).
+
+    :param reverse: if True, the search follows the commutations
+        backwards: only the neighbours which have the proof
+        as a neighbour are reached.
+    """
+    new_frontier = []
+    meeting = None
+    for proof in frontier:
+        for neighbour in proof.neighbours():
+            if neighbour in parents:
+                continue
+            if reverse and proof not in neighbour.neighbours():
+                continue
+            parents[neighbour] = proof
+            new_frontier.append(neighbour)
+            if neighbour in other_parents and (meeting is None or
+                    len(_chain(neighbour, other_parents)) < len(_chain(meeting, other_parents))):
+                meeting = neighbour
+    return new_frontier, meeting
+
+def _equivalence_classes(proof, done=(), max_explored=None):
+    """
+    Generates the equivalence classes of all the proofs reachable from
+    a proof by commutations, as lists: the strongly connected components
+    of the neighbour relation, found by Tarjan's algorithm
+    with an explicit stack.
+
+    :param done: proofs whose classes were already generated, which are
+        not explored again
+    :param max_explored: a budget of proofs to explore. The proofs beyond
+        it are ignored, so equivalent proofs may then be in different classes.
+    """
+    order = {}
+    lowlink = {}
+    component = []
+    on_component = set()
+    order[proof] = lowlink[proof] = 0
+    component.append(proof)
+    on_component.add(proof)
+    stack = [(proof, proof.neighbours())]
+    while stack:
+        current, neighbours = stack[-1]
+        neighbour = next(neighbours, None)
+        if neighbour is None:
+            stack.pop()
+            if stack:
+                parent = stack[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[current])
+            if lowlink[current] == order[current]:
+                members = []
+                while True:
+                    member = component.pop()
+                    on_component.discard(member)
+                    members.append(member)
+                    if member == current:
+                        break
+                yield members
+        elif neighbour not in order:
+            if neighbour in done or (
+                    max_explored is not None and len(order) >= max_explored):
+                continue
+            order[neighbour] = lowlink[neighbour] = len(order)
+            component.append(neighbour)
+            on_component.add(neighbour)
+            stack.append((neighbour, neighbour.neighbours()))
+        elif neighbour in on_component:
+            lowlink[current] = min(lowlink[current], order[neighbour])
+
+def _chain(proof, parents):
+    """
+    Follows the parents from a proof, up to the start of the search
+    """
+    chain = []
+    while proof is not None:
+        chain.append(proof)
+        proof = parents[proof]
+    return chain
@@ -1,10 +1,65 @@
+from collections import OrderedDict
+
 from rbgraph import R, B, r, b
 
+class CommutationCache(object):
+    """
+    A bounded cache of the commutations of pairs of proof steps,
+    evicting the least recently used entries first.
+    The numbers of hits and misses are counted.
+    """
+    def __init__(self, maxsize=2**16):
+        """
+        :param maxsize: the maximum number of entries (None for no bound)
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the entry for key, or None
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache and resets the counters
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class ProofStep(object):
+    # shared by all steps: see commutes_with_previous
+    commutations = CommutationCache()
+
     def __init__(self, terms, position):
         self.terms = terms
         self.position = position
 
+    def __setattr__(self, name, value):
+        # any change invalidates the cached hash
+        if name != '_hash':
+            object.__setattr__(self, '_hash', None)
+        object.__setattr__(self, name, value)
+
     def commutes_with_previous(self, previous, parent_terms):
         """
         Given the previous proof step "previous",
@@ -12,8 +67,35 @@ class ProofStep(object):
 
         If so, returns the commuted proof sequence
         as a pair.
+
+        The commutations are memoised in ProofStep.commutations,
+        keyed on the exact encodings of the parent terms and of the terms
+        of this step (merge coordinates depend on the order of the children,
+        so rotations cannot share entries, and the terms of a commuted merge
+        are only determined up to rotation by its premises) and on the kinds,
+        positions and coordinates of the steps.
         """
-        raise NotImplemented
+        key = (previous.key(), self.key(),
+               tuple(term.encoding() for term in parent_terms),
+               tuple(term.encoding() for term in self.terms))
+        commutations = self.commutations.get(key)
+        if commutations is None:
+            commutations = list(self._commutations(previous, parent_terms))
+            self.commutations.put(key, commutations)
+        for first, second in commutations:
+            yield (first.copy(), second.copy())
+
+    def _commutations(self, previous, parent_terms):
+        """
+        Generates the commutations, without memoisation
+        """
+        raise NotImplementedError
+
+    def key(self):
+        """
+        The kind, position and coordinates of this step
+        """
+        raise NotImplementedError
 
     def number_of_premises(self):
         """
@@ -25,7 +107,10 @@ class UnitAxiom(ProofStep):
     def __repr__(self):
         return "unit[{}]".format(self.position)
 
-    def commutes_with_previous(self, previous, parent_terms):
+    def key(self):
+        return ('unit', self.position)
+
+    def _commutations(self, previous, parent_terms):
         pp = previous.position
         secondstep = previous.copy()
         secondstep.terms = self.terms
@@ -48,7 +133,9 @@ class UnitAxiom(ProofStep):
         return UnitAxiom(terms[:position] + (B(r),) + terms[position:], position)
 
     def copy(self):
-        return UnitAxiom(self.terms, self.position)
+        new = UnitAxiom(self.terms, self.position)
+        new._hash = self._hash
+        return new
 
     def __eq__(self, other):
         return (isinstance(other, UnitAxiom) and
@@ -56,7 +143,13 @@ class UnitAxiom(ProofStep):
                 other.position == self.position)
 
     def __hash__(self):
-        return hash((self.terms,self.position))
+        # The terms are determined by the previous steps, except for the
+        # unit introduced. To keep hashing O(1), we only hash that part:
+        # proofs still get distinct hashes as the persistent vector of
+        # their steps mixes the hash of each step with its index.
+        if self._hash is None:
+            self._hash = hash((len(self.terms), self.position))
+        return self._hash
 
 
 class MergeStep(ProofStep):
@@ -67,7 +160,10 @@ class MergeStep(ProofStep):
     def __repr__(self):
         return "merge[{}] at {}".format(self.position, self.coords)
 
-    def commutes_with_previous(self, previous, parent_terms):
+    def key(self):
+        return ('merge', self.position, self.coords)
+
+    def _commutations(self, previous, parent_terms):
         secondstep = previous.copy()
         secondstep.terms = self.terms
         i,j,k,l = self.coords
@@ -110,30 +206,21 @@ class MergeStep(ProofStep):
                 first_merge_coords = (k1_orig, l1_orig, k2_orig, l2_orig)
                 i, j, k, l = first_merge_coords
                 term = b.merge(c, i, j, k, l)
-                second_merges = a.possible_merges(term)
+                # the second merge keeps the position of a in the target
+                second_merges = a.merges_into(term, target, i=i1_orig, j=j1_orig)
             else:
                 first_merge_coords = (i2_orig, j2_orig, i1_orig, j1_orig)
                 i, j, k, l = first_merge_coords
                 term = b.merge(c, i, j, k, l)
-                second_merges = term.possible_merges(a)
-
-            first_step = MergeStep(parent_terms[:p_first_merge] + (term,) + parent_terms[p_first_merge+2:],
-                    p_first_merge, first_merge_coords)
-
-            for candidate,i2,j2,k2,l2 in second_merges:
-                if self.position == previous.position:
-                    if (i2,j2) != (i1_orig, j1_orig):
-                        continue
-                else:
-                    if (k2,l2) != (k1_orig, k2_orig):
-                        continue
-
-                if candidate == target:
-                    firststep = MergeStep(parent_terms[:p_first_merge] + (term,) +
-                                          parent_terms[p_first_merge+2:], p_first_merge,
-                                          (i,j,k,l))
-                    secondstep = MergeStep(self.terms, self.position, (i2,j2,k2,l2))
-                    yield (firststep, secondstep)
+                # the second merge keeps the position of a in the target
+                second_merges = term.merges_into(a, target, k=k1_orig, l=l1_orig)
+
+            for i2,j2,k2,l2 in second_merges:
+                firststep = MergeStep(parent_terms[:p_first_merge] + (term,) +
+                                      parent_terms[p_first_merge+2:], p_first_merge,
+                                      (i,j,k,l))
+                secondstep = MergeStep(self.terms, self.position, (i2,j2,k2,l2))
+                yield (firststep, secondstep)
 
     def number_of_premises(self):
         return 2
@@ -145,7 +232,9 @@ class MergeStep(ProofStep):
                         position, coords)
 
     def copy(self):
-        return MergeStep(self.terms, self.position, self.coords)
+        new = MergeStep(self.terms, self.position, self.coords)
+        new._hash = self._hash
+        return new
 
     def __eq__(self, other):
         return (isinstance(other, MergeStep) and 
@@ -154,5 +243,10 @@ class MergeStep(ProofStep):
                 self.position == other.position)
 
     def __hash__(self):
-        return hash((self.terms,self.coords,self.position))
+        # The terms are determined by the previous steps, except for the
+        # merged graph. To keep hashing O(1), we only hash that part.
+        if self._hash is None:
+            self._hash = hash((len(self.terms), self.terms[self.position],
+                               self.coords, self.position))
+        return self._hash
 
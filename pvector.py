@@ -0,0 +1,147 @@
+"""
+Defines an immutable sequence with structure sharing
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+# hashes are summed modulo 2**64
+HASH_MASK = (1 << 64) - 1
+
+class PersistentVector(object):
+    """
+    An immutable sequence, stored as a trie of tuples of width 32.
+    Updating or appending an element returns a new vector in O(log n),
+    sharing all the untouched branches with the original one.
+
+    Its hash is the sum of the mixed hashes of the pairs (index, element).
+    It is computed when first needed, and then updated in O(1)
+    in the vectors derived by set and append.
+    """
+    __slots__ = ('_size', '_shift', '_root', '_hash')
+
+    def __init__(self, items=()):
+        self._size = 0
+        self._shift = 0
+        self._root = ()
+        self._hash = None
+        for item in items:
+            self._size, self._shift, self._root = self._appended(item)
+
+    @classmethod
+    def _make(cls, size, shift, root, hsh):
+        vector = cls.__new__(cls)
+        vector._size = size
+        vector._shift = shift
+        vector._root = root
+        vector._hash = hsh
+        return vector
+
+    def __len__(self):
+        return self._size
+
+    def _index(self, idx):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError('vector index out of range')
+        return idx
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return PersistentVector(
+                self[i] for i in range(*idx.indices(self._size)))
+        idx = self._index(idx)
+        node = self._root
+        for level in range(self._shift, 0, -BITS):
+            node = node[(idx >> level) & MASK]
+        return node[idx & MASK]
+
+    def __iter__(self):
+        return _walk(self._root, self._shift)
+
+    def set(self, idx, item):
+        """
+        Returns a new vector where the element at idx is replaced by item
+        """
+        idx = self._index(idx)
+        hsh = self._hash
+        if hsh is not None:
+            hsh = (hsh - _item_hash(idx, self[idx]) + _item_hash(idx, item)) & HASH_MASK
+        root = _set(self._root, self._shift, idx, item)
+        return self._make(self._size, self._shift, root, hsh)
+
+    def append(self, item):
+        """
+        Returns a new vector with item added at the end
+        """
+        size, shift, root = self._appended(item)
+        hsh = self._hash
+        if hsh is not None:
+            hsh = (hsh + _item_hash(self._size, item)) & HASH_MASK
+        return self._make(size, shift, root, hsh)
+
+    def _appended(self, item):
+        if self._size == WIDTH << self._shift:
+            # the trie is full: add a level
+            root = (self._root, _path(self._shift, item))
+            return (self._size + 1, self._shift + BITS, root)
+        return (self._size + 1, self._shift,
+                _push(self._root, self._shift, self._size, item))
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = sum(
+                _item_hash(idx, item) for idx, item in enumerate(self)) & HASH_MASK
+        return hash(self._hash)
+
+    def __eq__(self, other):
+        if isinstance(other, PersistentVector):
+            if self._size != other._size:
+                return False
+            if (self._hash is not None and other._hash is not None and
+                    self._hash != other._hash):
+                return False
+        elif not isinstance(other, (list, tuple)):
+            return NotImplemented
+        elif len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return 'PersistentVector({})'.format(list(self))
+
+
+def _item_hash(idx, item):
+    # tuple hashes are nearly linear in small integers, so their sums
+    # collide a lot: scramble them first (splitmix64 finaliser)
+    h = hash((idx, item)) & HASH_MASK
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & HASH_MASK
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & HASH_MASK
+    return h ^ (h >> 31)
+
+def _walk(node, level):
+    if level == 0:
+        yield from node
+    else:
+        for child in node:
+            yield from _walk(child, level - BITS)
+
+def _set(node, level, idx, item):
+    pos = (idx >> level) & MASK
+    if level == 0:
+        return node[:pos] + (item,) + node[pos+1:]
+    return node[:pos] + (_set(node[pos], level - BITS, idx, item),) + node[pos+1:]
+
+def _push(node, level, idx, item):
+    if level == 0:
+        return node + (item,)
+    pos = (idx >> level) & MASK
+    if pos < len(node):
+        return node[:pos] + (_push(node[pos], level - BITS, idx, item),) + node[pos+1:]
+    return node + (_path(level - BITS, item),)
+
+def _path(level, item):
+    if level == 0:
+        return (item,)
+    return (_path(level - BITS, item),)
@@ -3,14 +3,59 @@
 Defines red-blue graphs
 """
 
+import itertools
+import weakref
+from functools import partial
+
 class RBG(object):
-    def __init__(self, *children):
-        self.children = list(children)
-        self.size = 1 + sum(child.size for child in self.children)
-        # the self.links list contains pairs of indices:
+    """
+    A red-blue graph. Graphs are immutable and hash-consed:
+    building a graph whose children and links are identical
+    to those of a live graph returns that same graph.
+    """
+    __slots__ = ('children', 'links', 'size', '_offsets', '_units',
+                 '_encoding', '_canonical', '__weakref__')
+
+    # maps (ids of the children, links) to the corresponding live graph
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, *children, links=()):
+        links = tuple(links)
+        key = (tuple(map(id, children)), links)
+        node = cls._interned.get(key)
+        if node is not None:
+            return node
+
+        node = object.__new__(cls)
+        init = partial(object.__setattr__, node)
+        init('children', children)
+        # _offsets[i] is the number of nodes in the first i children
+        offsets = [0]
+        for child in children:
+            offsets.append(offsets[-1] + child.size)
+        init('_offsets', tuple(offsets))
+        init('size', 1 + offsets[-1])
+        # the links tuple contains pairs of indices:
         # (i,j) means that blue unit i is linked to red unit j
         # indices are counted just like in the to_graph function.
-        self.links = []
+        init('links', links)
+        # number of units, as returned by units(blue=False) and units(blue=True)
+        if children:
+            init('_units', (sum(child._units[1] for child in children),
+                            sum(child._units[0] for child in children)))
+        else:
+            init('_units', (0, 1))
+        # caches for encoding and canonical_encoding
+        init('_encoding', None)
+        init('_canonical', None)
+        cls._interned[key] = node
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError('red-blue graphs are immutable')
+
+    def __reduce__(self):
+        return (_rebuild, (self.children, self.links))
 
     def __getitem__(self, key):
         # our sequents are cyclic
@@ -27,42 +72,85 @@ class RBG(object):
     def __len__(self):
         return len(self.children)
 
+    def view(self, start, length):
+        """
+        Same as self[start,length], but returns a view
+        on the children of this graph instead of a new graph.
+        """
+        return CyclicSlice(self, start, length)
+
     def __eq__(self, other, cyclic=True):
+        if self is other:
+            return True
+        if not isinstance(other, RBG):
+            return NotImplemented
         if self.size != other.size:
             return False
 
-        # try to match self to other
-        if len(self) != len(other):
-            return False
+        # our sequents are cyclic at the root only:
+        # subtrees are compared as plain ordered trees
         if cyclic:
-            # if matching in cyclic mode,
-            # try all the possible offsets
-            offsets = range(len(self))
+            return self.canonical_encoding() == other.canonical_encoding()
         else:
-            # otherwise, just zero
-            offsets = [0]
+            return self.encoding() == other.encoding()
 
-        for offset in offsets:
-            matching = all(
-                self[i].__eq__(other[i+offset], cyclic=False)
-                for i in range(len(self))
-            )
-            if matching:
-                return True
+    def __hash__(self):
+        return hash(self.canonical_encoding())
 
-        return len(self) == 0
+    def encoding(self):
+        """
+        Returns a string encoding the shape of this graph,
+        reading the children in their stored order.
+        Two graphs have the same encoding if and only if
+        they are equal as ordered trees.
+        """
+        if self._encoding is None:
+            object.__setattr__(self, '_encoding', '({})'.format(
+                ''.join(child.encoding() for child in self.children)))
+        return self._encoding
 
-    def __hash__(self):
-        return self.size
+    @classmethod
+    def from_encoding(cls, encoding):
+        """
+        Builds the graph with the given encoding (as returned
+        by the encoding method).
+        """
+        stack = [[]]
+        for char in encoding:
+            if char == '(':
+                stack.append([])
+            elif char == ')':
+                children = stack.pop()
+                stack[-1].append(cls(*children))
+            else:
+                raise ValueError('Invalid graph encoding: {}'.format(encoding))
+        if len(stack) != 1 or len(stack[0]) != 1:
+            raise ValueError('Invalid graph encoding: {}'.format(encoding))
+        return stack[0][0]
+
+    def canonical_encoding(self):
+        """
+        Returns a string encoding this graph up to rotation
+        of the children of its root: we pick the lexicographically
+        minimal rotation of the encodings of the children.
+        Two graphs are equal if and only if their canonical
+        encodings are equal.
+        """
+        if self._canonical is None:
+            encodings = [child.encoding() for child in self.children]
+            rotations = (
+                tuple(encodings[start:] + encodings[:start])
+                for start in range(len(encodings))
+            )
+            object.__setattr__(self, '_canonical',
+                '({})'.format(''.join(min(rotations, default=()))))
+        return self._canonical
 
     def units(self, blue=False):
         """
         Number of units of the given color
         """
-        if not self.children and blue:
-            return 1
-        else:
-            return sum(child.units(blue=not blue) for child in self.children)
+        return self._units[1 if blue else 0]
 
     def __add__(self, other):
         return RBG(*(self.children + other.children))
@@ -78,50 +166,157 @@ class RBG(object):
         Returns the merged graph obtained by joining
         the subgraphs self[i,j], self[k,l] by a red node
         """
-        red_left = self[i,j]
-        left_list = red_left[0].children if len(red_left) == 1 else [red_left]
-        red_right = other[k,l]
-        right_list = red_right[0].children if len(red_right) == 1 else [red_right]
+        red_left = self.view(i,j)
+        left_list = red_left[0].children if len(red_left) == 1 else (red_left.to_rbg(),)
+        red_right = other.view(k,l)
+        right_list = red_right[0].children if len(red_right) == 1 else (red_right.to_rbg(),)
 
-        red_fragment = RBG(RBG(*(left_list + right_list)))
+        red_fragment = (RBG(*(left_list + right_list)),)
         if len(left_list) + len(right_list) == 1:
             # simplify red unitality
-            red_fragment = sum(left_list, RBG()) + sum(right_list, RBG())
+            red_fragment = (left_list + right_list)[0].children
 
-        blue_left = self[i+j,len(self)-j]
-        blue_right = other[k+l,len(other)-l]
+        blue_left = self.view(i+j,len(self)-j)
+        blue_right = other.view(k+l,len(other)-l)
 
         # TODO: handle simplification case in unit translation
         size_red_left = red_left.number_of_nodes()
         size_blue_right = blue_right.number_of_nodes()
-        size_other = other.number_of_nodes()
-        final_graph = red_fragment + blue_right + blue_left
-        final_graph.links = []
-        final_graph.links += self.translate_links(i, j, 2, 1 + size_other + size_red_left)
-        final_graph.links += other.translate_links(k, l, 2 + size_red_left, 1 + size_red_left + size_blue_right)
-        return final_graph
-
-    def possible_merges(self, rhs):
-        for i in range(len(self)):
+        size_other = other.size
+        links = (self.translate_links(i, j, 2, 1 + size_other + size_red_left) +
+                 other.translate_links(k, l, 2 + size_red_left, 1 + size_red_left + size_blue_right))
+        return RBG(*red_fragment, *blue_right, *blue_left, links=links)
+
+    def possible_merges(self, rhs, distinct=False):
+        """
+        Generates all the merges of this graph with rhs,
+        as tuples (term,i,j,k,l).
+
+        If distinct=True, generates pairs (term, coords) instead,
+        where each resulting term appears only once, with the sorted list
+        of all the coordinates (i,j,k,l) that produce it. Coordinates
+        which only differ by a symmetry of self or rhs are then
+        not merged again.
+        """
+        if not distinct:
+            for i in range(len(self)):
+                for j in range(len(self)+1):
+                    for k in range(len(rhs)):
+                        for l in range(len(rhs)+1):
+                            term = self.merge(rhs,i,j,k,l)
+                            yield (term,i,j,k,l)
+            return
+
+        if not len(self) or not len(rhs):
+            return
+        period_lhs = self.rotation_period()
+        period_rhs = rhs.rotation_period()
+        shifts = [(di, dk)
+                  for di in range(0, len(self), period_lhs)
+                  for dk in range(0, len(rhs), period_rhs)]
+        merges = {}
+        for i in range(period_lhs):
             for j in range(len(self)+1):
-                for k in range(len(rhs)):
+                for k in range(period_rhs):
                     for l in range(len(rhs)+1):
                         term = self.merge(rhs,i,j,k,l)
-                        yield (term,i,j,k,l)
+                        coords = merges.get(term)
+                        if coords is None:
+                            coords = merges[term] = []
+                        coords.extend((i+di,j,k+dk,l) for di, dk in shifts)
+        for term, coords in merges.items():
+            if len(shifts) > 1:
+                coords.sort()
+            yield (term, coords)
+
+    def merges_into(self, other, target, i=None, j=None, k=None, l=None):
+        """
+        Generates the coordinates (i,j,k,l) such that
+        self.merge(other,i,j,k,l) == target, in the order of possible_merges.
+
+        The coordinates given are fixed, and only the others are searched.
+        Candidates whose number of children or of nodes differ from
+        those of the target are rejected without being built.
+        """
+        def coordinate(value, bound):
+            if value is None:
+                return range(bound)
+            return (value,) if 0 <= value < bound else ()
+        shape = (len(target), target.size)
+        for coords in itertools.product(coordinate(i, len(self)),
+                                        coordinate(j, len(self)+1),
+                                        coordinate(k, len(other)),
+                                        coordinate(l, len(other)+1)):
+            if (self._merge_shape(other, *coords) == shape and
+                    self.merge(other, *coords) == target):
+                yield coords
+
+    def _merge_shape(self, other, i, j, k, l):
+        """
+        Returns the number of children and the number of nodes
+        of self.merge(other,i,j,k,l), without building it.
+        """
+        fragments = self._fragment_shapes(i, j) + other._fragment_shapes(k, l)
+        if len(fragments) == 1:
+            # red unitality: the children of the fragment are lifted
+            red_children, red_nodes = fragments[0][0], fragments[0][1] - 1
+        else:
+            red_children, red_nodes = 1, 1 + sum(nodes for _, nodes in fragments)
+        blue_children = max(len(self) - j, 0) + max(len(other) - l, 0)
+        blue_nodes = (self.slice_size(i+j, len(self)-j) - 1 +
+                      other.slice_size(k+l, len(other)-l) - 1)
+        return (red_children + blue_children, 1 + red_nodes + blue_nodes)
+
+    def _fragment_shapes(self, i, j):
+        # shapes (children, nodes) of the graphs merge joins from self[i,j]
+        if j == 1:
+            return [(len(child), child.size) for child in self.view(i, 1)[0].children]
+        return [(max(j, 0), self.slice_size(i, j))]
+
+    def rotation_period(self):
+        """
+        Returns the smallest positive rotation of the children
+        that leaves this graph unchanged (including its links).
+        """
+        n = len(self)
+        if self.links:
+            return max(n, 1)
+        for period in range(1, n):
+            if n % period == 0 and all(
+                    self.children[idx] is self.children[(idx + period) % n]
+                    for idx in range(n)):
+                return period
+        return max(n, 1)
 
     def number_of_nodes(self):
         """
         Returns the number of nodes in this graph
         """
-        return 1 + sum(c.number_of_nodes()
-                for c in self.children)
+        return self.size
+
+    def slice_size(self, start, length):
+        """
+        Returns the number of nodes of self[start,length],
+        without building that graph.
+        """
+        if length <= 0:
+            return 1
+        n = len(self)
+        start = start % n
+        laps, length = divmod(length, n)
+        end = start + length
+        if end <= n:
+            nodes = self._offsets[end] - self._offsets[start]
+        else:
+            nodes = self._offsets[n] - self._offsets[start] + self._offsets[end - n]
+        return 1 + laps * self._offsets[n] + nodes
 
     def build_translation(self, i, j, offset_in, translation):
         """
         Populates the unit translation dictionary for the slice [i,j]
         of this graph, with the given offset.
         """
-        size_before_in = self[0,i].number_of_nodes()
+        size_before_in = self.slice_size(0, i)
         cur_idx = size_before_in
         rel_idx = 1
         for idx in range(i,i+j):
@@ -200,6 +395,59 @@ class RBG(object):
         g.render(filename=name)
 
 
+class CyclicSlice(object):
+    """
+    A read-only view on a cyclic sequence of consecutive
+    children of a graph, which does not copy them.
+    """
+    __slots__ = ('parent', 'start', 'length')
+
+    def __init__(self, parent, start, length):
+        # like parent[start,length], negative lengths give empty slices
+        length = max(length, 0)
+        self.parent = parent
+        self.start = start % len(parent) if length else 0
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.length:
+            raise IndexError('slice index out of range')
+        return self.parent[self.start + idx]
+
+    def __iter__(self):
+        for idx in range(self.start, self.start + self.length):
+            yield self.parent[idx]
+
+    @property
+    def children(self):
+        return tuple(self)
+
+    def __add__(self, other):
+        return RBG(*self, *other.children)
+
+    def number_of_nodes(self):
+        """
+        Number of nodes of the graph obtained by materializing this view
+        """
+        return self.parent.slice_size(self.start, self.length)
+
+    def to_rbg(self):
+        """
+        Builds the graph that has the children in this view
+        """
+        return RBG(*self)
+
+
+def _rebuild(children, links):
+    """
+    Unpickling helper, going through the interning table
+    """
+    return RBG(*children, links=links)
+
+
 R = RBG
 B = RBG
 b = B()
@@ -1,11 +1,20 @@
 from formula import Tens, Parr, Bot, Top
+from unionfind import UnionFind
 
 class Switching(object):
-    def __init__(self, linking, directions):
+    def __init__(self, linking, directions, parent_map=None):
+        """
+        :param linking: the linking that is switched
+        :param directions: a mapping from the indices of the switched
+            connectives to True (left) or False (right)
+        :param parent_map: the parent map of the formula, if already computed
+        """
         self.linking = linking
         self.formula = linking.formula
         self.directions = directions
-        self.parent_map = self.formula.parent_map()
+        if parent_map is None:
+            parent_map = self.formula.parent_map()
+        self.parent_map = parent_map
 
     def browse(self, current=0, coming_from=None):
         """
@@ -64,6 +73,10 @@ class Switching(object):
 
     @classmethod
     def enumerate(cls, linking, only_parr=True):
+        """
+        Generates all the switchings of a linking, in Gray code order:
+        each switching differs from the previous one by a single direction.
+        """
         formula = linking.formula
         valid_connectives = [Parr]
         if not only_parr:
@@ -74,15 +87,76 @@ class Switching(object):
             if any(isinstance(subformula, node)
                     for node in valid_connectives)
         ]
-        bound = pow(2, len(parr_indices))
-        for i in range(bound):
-            remainder = i
-            dct = {}
-            for idx in parr_indices:
-                dct[idx] = (remainder % 2 == 1)
-                remainder = remainder // 2
-            yield cls(linking, dct)
+        parent_map = formula.parent_map()
+        dct = {idx: False for idx in parr_indices}
+        yield cls(linking, dict(dct), parent_map)
+        for bit in cls.gray_code(len(parr_indices)):
+            idx = parr_indices[bit]
+            dct[idx] = not dct[idx]
+            yield cls(linking, dict(dct), parent_map)
+
+    @staticmethod
+    def gray_code(n):
+        """
+        Generates the positions of the bits to flip to go through
+        all the words of n bits, starting from zero.
+
+        >>> list(Switching.gray_code(3))
+        [0, 1, 0, 2, 0, 1, 0]
+        """
+        for i in range(1, pow(2, n)):
+            yield (i & -i).bit_length() - 1
+
+    @classmethod
+    def sweep(cls, linking):
+        """
+        Generates all the switchings of a linking, in the order of enumerate,
+        each with whether it is acyclic and connected.
+
+        The edges which do not depend on the switching (links, premises
+        of Tensors, conclusions) are contracted once. Each switching then
+        only adds one edge per Parr between the contracted vertices, and
+        is correct if and only if these edges form a spanning tree.
+        When a flip makes some of these edges loops, or when there
+        cannot be a spanning tree at all, no evaluation is needed.
+        """
+        formula = linking.formula
+        parent_map = formula.parent_map()
+        classes, premises, has_cycle = linking.static_contraction(parent_map)
+
+        # the two possible edges of each Parr, between contracted vertices
+        components = {}
+        for i in range(len(formula)):
+            components.setdefault(classes.find(i), len(components))
+        parr_indices = sorted(premises)
+        ends = [
+            (components[classes.find(parr)],
+             components[classes.find(premises[parr][1])],
+             components[classes.find(premises[parr][0])])
+            for parr in parr_indices
+        ]
+        possible = not has_cycle and len(parr_indices) == len(components) - 1
+
+        def evaluate(chosen):
+            vertices = UnionFind(len(components))
+            return all(vertices.union(parr[0], parr[end])
+                       for parr, end in zip(ends, chosen))
 
+        # chosen[i] is 2 if the ith Parr is switched to the left, 1 otherwise
+        chosen = [1] * len(parr_indices)
+        loops = sum(parr[0] == parr[1] for parr in ends)
+        dct = {idx: False for idx in parr_indices}
+        yield (cls(linking, dict(dct), parent_map),
+               possible and not loops and evaluate(chosen))
+        for bit in cls.gray_code(len(parr_indices)):
+            parr = ends[bit]
+            loops -= parr[0] == parr[chosen[bit]]
+            chosen[bit] = 3 - chosen[bit]
+            loops += parr[0] == parr[chosen[bit]]
+            idx = parr_indices[bit]
+            dct[idx] = not dct[idx]
+            yield (cls(linking, dict(dct), parent_map),
+                   possible and not loops and evaluate(chosen))
 
     def long_trip(self, cur_idx=0, cur_dir=True, coming_from=None):
         """
@@ -1,11 +1,14 @@
+import itertools
 import unittest
 
 from rbgraph import RBG, R, B, r, b
-from proofstep import UnitAxiom, MergeStep
+from proofstep import ProofStep, UnitAxiom, MergeStep
 from proof import Proof
 from formula import Tens, Parr, Bot, Top
-from linking import Linking
+from linking import Linking, sweep, sweep_to_file
 from switching import Switching
+from backtrack import BacktrackTable
+from pvector import PersistentVector
 
 class RBGTest(unittest.TestCase):
     def test_simple_equality(self):
@@ -15,6 +18,42 @@ class RBGTest(unittest.TestCase):
         self.assertNotEqual(B(r), B(r,r))
         self.assertEqual(B(r,r,R(b,b)), B(r,R(b,b),r))
 
+    def test_canonical_hash(self):
+        self.assertEqual(hash(B(r,r,R(b,b))), hash(B(r,R(b,b),r)))
+        self.assertEqual(B(r,R(b,b)).canonical_encoding(),
+                         B(R(b,b),r).canonical_encoding())
+        # rotations are only allowed at the root
+        self.assertNotEqual(B(R(r,B(b,b))), B(R(B(b,b),r)))
+        self.assertEqual(len({B(r,r,R(b,b)), B(R(b,b),r,r), B(r,R(b,b),r)}), 1)
+
+    def test_interning(self):
+        self.assertIs(B(r,R(b,b)), B(r,R(b,b)))
+        self.assertIs(B(r).merge(B(r), 0, 1, 0, 1), B(r))
+        # rotations are equal but remain distinct graphs
+        self.assertIsNot(B(r,R(b,b)), B(R(b,b),r))
+        with self.assertRaises(AttributeError):
+            B(r).children = ()
+        self.assertEqual(B(r,R(b,b)).units(), 1)
+        self.assertEqual(B(r,R(b,b)).units(blue=True), 2)
+
+    def test_slice_size(self):
+        g = B(R(b,b),r,R(B(r),b))
+        for start in range(-1, 4):
+            for length in range(7):
+                self.assertEqual(g.slice_size(start, length),
+                                 g[start,length].number_of_nodes())
+
+    def test_view(self):
+        g = B(R(b,b),r,R(B(r),b))
+        view = g.view(2, 2)
+        self.assertEqual(len(view), 2)
+        self.assertEqual(list(view), [R(B(r),b), R(b,b)])
+        self.assertEqual(view.to_rbg(), g[2,2])
+        self.assertEqual(view.number_of_nodes(), g[2,2].number_of_nodes())
+        self.assertEqual(view + g.view(1, 1), B(R(B(r),b),R(b,b),r))
+        self.assertEqual(len(g.view(1, -1)), len(g[1,-1]))
+        self.assertEqual(g.slice_size(1, -1), g[1,-1].number_of_nodes())
+
     def test_merge(self):
         # creating a gadget
         unit = R(b)
@@ -56,6 +95,31 @@ class RBGTest(unittest.TestCase):
         # checking unit counts
         self.assertEqual(triple_unit.units(), 4)
 
+    def test_distinct_merges(self):
+        lhs = B(r,r,r)
+        rhs = B(r,R(b,b))
+        self.assertEqual(lhs.rotation_period(), 1)
+        self.assertEqual(rhs.rotation_period(), 2)
+        all_merges = list(lhs.possible_merges(rhs))
+        distinct = list(lhs.possible_merges(rhs, distinct=True))
+        self.assertEqual(len(distinct), len(set(m[0] for m in all_merges)))
+        self.assertEqual(sorted(c for _, coords in distinct for c in coords),
+                         sorted(m[1:] for m in all_merges))
+        for term, coords in distinct:
+            for i, j, k, l in coords:
+                self.assertEqual(lhs.merge(rhs, i, j, k, l), term)
+
+    def test_merges_into(self):
+        lhs = B(R(b,b),r,r)
+        rhs = B(r,R(b,B(r,r)))
+        for target, i, j, k, l in lhs.possible_merges(rhs):
+            self.assertEqual(lhs._merge_shape(rhs, i, j, k, l), (len(target), target.size))
+            expected = [m[1:] for m in lhs.possible_merges(rhs)
+                        if m[1:3] == (i,j) and m[0] == target]
+            self.assertEqual(list(lhs.merges_into(rhs, target, i=i, j=j)), expected)
+            self.assertIn((i,j,k,l), lhs.merges_into(rhs, target, k=k, l=l))
+        self.assertEqual(list(lhs.merges_into(rhs, B(r), i=len(lhs))), [])
+
     def test_order(self):
         unit = B(r)
         gadget = unit.merge(unit)
@@ -92,12 +156,47 @@ class ProofStepTest(unittest.TestCase):
         self.assertEqual(commutation,
               [(firststep2, secondstep2)])
 
+    def test_commutation_cache(self):
+        parent = (B(r),B(r),B(r),B(r))
+        firststep = MergeStep.from_parent(parent, 0, (0,0,0,0))
+        secondstep = MergeStep.from_parent(firststep.terms, 1, (0,0,0,0))
+        cache = ProofStep.commutations
+        cache.clear()
+        first = list(secondstep.commutes_with_previous(firststep, parent))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        second = list(secondstep.commutes_with_previous(firststep, parent))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(first, second)
+        self.assertEqual(first, list(secondstep._commutations(firststep, parent)))
+        # the steps returned are fresh copies
+        self.assertIsNot(first[0][0], second[0][0])
+        # a step with rotated terms does not share the entry
+        rotated = MergeStep((B(R(b,b),r,r), B(r,R(b,b),r)), 1, (0,0,0,0))
+        self.assertEqual(rotated.terms, secondstep.terms)
+        commutations = list(rotated.commutes_with_previous(firststep, parent))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual([[step.terms[step.position].encoding() for step in pair]
+                          for pair in commutations],
+                         [[step.terms[step.position].encoding() for step in pair]
+                          for pair in rotated._commutations(firststep, parent)])
+
+def _irreversible_proof():
+    # the terms of the last two merges are rotated, so that one of
+    # the commutations of this proof cannot be reversed
+    q = Proof().unit(0).unit(1).unit(2).unit(1).merge(2)
+    q.add_step(MergeStep((B(r), B(R(b,b),r,r,r,R(b,b))), 1, (0,0,0,0)))
+    q.add_step(MergeStep((B(R(b,b),R(b,b),r,r,r,R(b,b),r),), 0, (0,0,0,0)))
+    return q
+
 class ProofTest(unittest.TestCase):
     def test_neighbours(self):
         p1 = Proof().unit().unit()
         p2 = Proof().unit().unit(1)
+        hash(p1)
         neighbours = list(p1.neighbours())
         self.assertEqual([p2], neighbours)
+        # the hash of the neighbour is derived from that of p1
+        self.assertEqual(hash(p2), hash(neighbours[0]))
 
         pu = Proof().unit()
         self.assertEqual([], list(pu.neighbours()))
@@ -111,6 +210,110 @@ class ProofTest(unittest.TestCase):
         self.assertEqual(p3, p4)
         self.assertEqual(len(list(p3.equivalence_class())), 24)
 
+    def test_equivalence_class_limits(self):
+        p5 = Proof().unit().unit().unit().unit().unit()
+        self.assertEqual(len(list(p5.equivalence_class())), 120)
+        self.assertEqual(len(list(p5.equivalence_class(max_proofs=7))), 7)
+        seen = set()
+        self.assertEqual(len(list(p5.equivalence_class(seen=seen, max_seen=30))), 30)
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(list(p5.equivalence_class(timeout=0)), [])
+
+    def test_hash_spread(self):
+        units = Proof()
+        for _ in range(20):
+            units.unit()
+        merges = Proof()
+        for _ in range(8):
+            merges.unit()
+        for _ in range(7):
+            merges.merge()
+        for p in [units, merges]:
+            members = list(p.equivalence_class(max_proofs=2000))
+            self.assertEqual(len(members), 2000)
+            self.assertEqual(len(set(map(hash, members))), len(members))
+
+    def test_equivalence_path(self):
+        p = Proof().unit().unit().unit()
+        q = Proof().unit().unit(1).unit(2)
+        for astar in [False, True]:
+            path = p.equivalence_path(q, astar=astar)
+            self.assertEqual(path[0], q)
+            self.assertEqual(path[-1], p)
+            self.assertEqual(len(path), 4)
+            for a, b in zip(path, path[1:]):
+                self.assertIn(a, list(b.neighbours()))
+        self.assertEqual(p.equivalence_path(p), [p])
+        self.assertIsNone(p.equivalence_path(Proof().unit().unit()))
+
+    def test_irreversible_equivalence_path(self):
+        q = _irreversible_proof()
+        # the only neighbour of q which does not have q as a neighbour
+        [n] = [n for n in q.neighbours() if q not in list(n.neighbours())]
+        self.assertEqual(q.equivalence_path(n), [n, q])
+        for astar in [False, True]:
+            path = n.equivalence_path(q, astar=astar)
+            self.assertEqual(path[0], q)
+            self.assertEqual(path[-1], n)
+            self.assertTrue(len(path) > 2)
+            for a, b in zip(path, path[1:]):
+                self.assertIn(a, list(b.neighbours()))
+
+    def test_canonical_form(self):
+        p = Proof().unit().unit().merge().unit()
+        index = {}
+        canonical = p.canonical_form(index)
+        members = list(p.equivalence_class())
+        self.assertEqual(len(index), len(members))
+        self.assertTrue(all(q.canonical_form(index) == canonical for q in members))
+        self.assertEqual(canonical, min(members, key=Proof.sort_key))
+        self.assertTrue(p.equivalent(members[-1], index))
+        self.assertFalse(p.equivalent(Proof().unit().unit().merge(), index))
+
+    def test_irreversible_equivalence(self):
+        # q can be reached from p by commutations, but not the other way around
+        p = Proof().unit(0).unit(1).unit(2).merge(1).merge(0).unit(1).merge(0, (2,0,0,0))
+        q = Proof().unit().unit().unit().unit().merge().merge(0, (1,0,0,0)).merge(0, (1,0,0,0))
+        self.assertIn(q, list(p.equivalence_class()))
+        self.assertNotIn(p, list(q.equivalence_class()))
+        for a, b in [(p, q), (q, p)]:
+            self.assertFalse(a.equivalent(b))
+            self.assertFalse(a.equivalent(b, {}))
+        # recording the class of q first does not change the index
+        index = {}
+        q.canonical_form(index)
+        recorded = dict(index)
+        self.assertFalse(p.equivalent(q, index))
+        self.assertTrue(all(index[member] is canonical
+                            for member, canonical in recorded.items()))
+        self.assertTrue(p.equivalent(p.canonical_form(), index))
+
+    def test_partition(self):
+        backtrack = Proof.enumerate(3)
+        term = B(R(B(R(b,b),r),b),r,R(b,B(r,r)))
+        proofs = list(Proof.reconstruct((), term, Proof(), backtrack))
+        classes = Proof.partition(proofs)
+        self.assertEqual(sum(len(members) for _, members, _ in classes), len(proofs))
+        index = {}
+        for representative, members, size in classes:
+            canonical = representative.canonical_form(index)
+            self.assertEqual(size, sum(1 for p in representative.equivalence_class()
+                                       if p.canonical_form(index) == canonical))
+            self.assertTrue(all(p.equivalent(representative) for p in members))
+        for (p, _, _), (q, _, _) in itertools.combinations(classes, 2):
+            self.assertFalse(p.equivalent(q))
+        # q can be reached from p, but not the other way around
+        p = Proof().unit(0).unit(1).unit(2).merge(1).merge(0).unit(1).merge(0, (2,0,0,0))
+        q = Proof().unit().unit().unit().unit().merge().merge(0, (1,0,0,0)).merge(0, (1,0,0,0))
+        for stream in [[p, q], [q, p]]:
+            classes = Proof.partition(stream)
+            self.assertEqual([members for _, members, _ in classes], [[s] for s in stream])
+            sizes = {representative: size for representative, _, size in classes}
+            self.assertEqual((sizes[p], sizes[q]), (96, 272))
+        budgeted = Proof.partition(proofs, max_explored=2)
+        self.assertEqual(sum(len(members) for _, members, _ in budgeted), len(proofs))
+        self.assertTrue(len(budgeted) >= len(classes))
+
     def test_proofs_with_two_merges(self):
         # proofs of depth 2 should all be equivalent
         backtrack = Proof.enumerate(2)
@@ -119,12 +322,72 @@ class ProofTest(unittest.TestCase):
         equiv_class = list(p0.equivalence_class())
         self.assertTrue(all(p in equiv_class for p in proofs))
 
+    def test_parallel_enumeration(self):
+        backtrack = Proof.enumerate(3)
+        parallel_backtrack = Proof.enumerate(3, workers=2)
+        self.assertEqual(list(backtrack), list(parallel_backtrack))
+        for term in backtrack:
+            self.assertEqual(backtrack[term], parallel_backtrack[term])
+
+    def test_resumable_enumeration(self):
+        import tempfile
+        triple_unit = B(R(B(R(b,b),r),b),r,R(b,B(r,r)))
+        backtrack = Proof.enumerate(3)
+        with tempfile.TemporaryDirectory() as path:
+            Proof.enumerate(2, store=path)
+            stored_backtrack = Proof.enumerate(3, store=path)
+            self.assertEqual(list(backtrack), list(stored_backtrack))
+            for term in backtrack:
+                self.assertEqual(backtrack[term], stored_backtrack[term])
+            proofs = list(Proof.reconstruct((), triple_unit, Proof(), stored_backtrack))
+            self.assertEqual(len(proofs), 2)
+
+    def test_count_and_nth(self):
+        backtrack, reachable = Proof.enumerate(3, counts=True)
+        triple_unit = B(R(B(R(b,b),r),b),r,R(b,B(r,r)))
+        self.assertEqual(reachable[3][triple_unit], 2)
+        self.assertEqual(Proof.count(triple_unit, backtrack), 2)
+        term = B(R(b,b),r,r,R(b,b),r)
+        proofs = list(Proof.reconstruct((), term, Proof(), backtrack))
+        self.assertEqual(Proof.count(term, backtrack), len(proofs))
+        self.assertEqual(reachable[2][term], len(proofs))
+        for idx, proof in enumerate(proofs):
+            self.assertEqual(Proof.nth(term, idx, backtrack), proof)
+        with self.assertRaises(IndexError):
+            Proof.nth(term, len(proofs), backtrack)
+
+    def test_reconstruct_in_context(self):
+        backtrack = Proof.enumerate(1)
+        gadget = B(r,R(b,b),r)
+        proofs = list(Proof.reconstruct((B(r),), gadget, Proof().unit(), backtrack))
+        self.assertEqual(proofs, [Proof().unit().unit(1).unit(2).merge(1)])
+
+    def test_sample(self):
+        backtrack = Proof.enumerate(2)
+        term = B(R(b,b),r,r,R(b,b),r)
+        proofs = list(Proof.reconstruct((), term, Proof(), backtrack))
+        sample = list(Proof.sample(term, backtrack, 50, seed=1))
+        self.assertEqual(len(sample), 50)
+        self.assertTrue(all(p in proofs for p in sample))
+        self.assertEqual(sample, list(Proof.sample(term, backtrack, 50, seed=1)))
+        with self.assertRaises(IndexError):
+            list(Proof.sample(B(R(b,b,b,b,b)), backtrack, 1))
+
     def test_unit_removal(self):
         p1 = Proof().unit().unit().unit()
         p1_no_units = p1.remove_unit_intros()
         self.assertEqual(len(p1_no_units), 0)
         self.assertEqual(p1.conclusion, p1_no_units.hypotheses)
 
+        p2 = Proof().unit().unit().merge().unit(1).unit().merge(1).merge()
+        p2_no_units = p2.remove_unit_intros()
+        self.assertEqual(p2_no_units.hypotheses, (B(r),)*4)
+        self.assertEqual([step.position for step in p2_no_units.steps], [1, 1, 0])
+        self.assertTrue(all(isinstance(step, MergeStep) for step in p2_no_units.steps))
+        self.assertEqual(p2_no_units.conclusion, p2.conclusion)
+        p3 = Proof((B(r), B(r))).merge()
+        self.assertEqual(p3.remove_unit_intros(), p3)
+
         p2 = Proof().unit().unit().merge().unit().unit().merge(1)
         p2_no_units = p2.remove_unit_intros()
         self.assertEqual(len(p2_no_units), 2)
@@ -142,6 +405,51 @@ class ProofTest(unittest.TestCase):
         p1 = proofs[1]
         self.assertFalse(p0.equivalent(p1))
 
+class BacktrackTableTest(unittest.TestCase):
+    def test_rows(self):
+        table = BacktrackTable()
+        gadget = B(r,R(b,b),r)
+        table.extend(gadget, B(r), B(r), [(0,0,0,0)])
+        table.add(B(r,r), gadget, B(r), 0, 1, 0, 1)
+        table.add(gadget, B(r), B(r), 0, 0, 0, 1)
+        self.assertEqual(list(table), [gadget, B(r,r)])
+        self.assertEqual(table[gadget],
+            [(B(r), B(r), 0, 0, 0, 0), (B(r), B(r), 0, 0, 0, 1)])
+        self.assertEqual(list(table.rows(B(r,r))),
+            [(table.term_id(gadget), table.term_id(B(r)), 0, 1, 0, 1)])
+        self.assertEqual(table[B(r)], [])
+        self.assertNotIn(B(r), table)
+        table.clear_rows()
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.term_id(gadget), 0)
+
+class PersistentVectorTest(unittest.TestCase):
+    def test_updates(self):
+        items = list(range(100))
+        vector = PersistentVector(items)
+        hash(vector)
+        updated = vector.set(40, 'x').append('y')
+        items[40] = 'x'
+        items.append('y')
+        self.assertEqual(list(updated), items)
+        self.assertEqual(list(vector), list(range(100)))
+        self.assertEqual(updated, PersistentVector(items))
+        self.assertEqual(hash(updated), hash(PersistentVector(items)))
+        self.assertEqual(list(updated[95:]), items[95:])
+        self.assertEqual(updated[-1], 'y')
+        with self.assertRaises(IndexError):
+            updated[101]
+
+    def test_hash_spread(self):
+        # like the steps of proofs introducing units at various positions
+        vectors = [
+            PersistentVector((idx + 1, position) for idx, position in enumerate(positions))
+            for positions in itertools.product(*(range(n) for n in range(1, 7)))
+        ]
+        self.assertEqual(len(set(map(hash, vectors))), len(vectors))
+        updated = [vector.set(3, (4, 0)).append((7, 0)) for vector in vectors]
+        self.assertEqual(len(set(map(hash, updated))), len(vectors) // 4)
+
 class FormulaTest(unittest.TestCase):
     def test_parent_map(self):
         f = Parr(Tens(Bot(), Bot()), Parr(Top(), Top()))
@@ -169,7 +477,17 @@ class LinkingTest(unittest.TestCase):
         three_proofs = Tens(gadget, gadget)
         l = Linking(three_proofs, [(14, 2), (13, 4), (6, 11), (7, 9)])
         self.assertFalse(l.is_symmetric_proof())
+        self.assertFalse(l.is_symmetric_proof(exhaustive=True))
 
+    def test_contraction_criterion(self):
+        for formula in Parr.enumerate_normalized(9):
+            for l in Linking.enumerate(formula):
+                self.assertEqual(l.is_symmetric_proof(),
+                                 l.is_symmetric_proof(exhaustive=True))
+        f = Parr(Tens(Bot(), Bot()), Parr(Top(), Top()))
+        self.assertEqual(Linking(f, [(2, 5), (3, 6)]).contract(), 1)
+        self.assertIsNone(Linking(f, [(2, 5), (3, 5)]).contract())
+        self.assertEqual(Linking(Parr(Top(), Top()), []).contract(), 3)
 
     def test_enumerate_linkings(self):
         f = Parr(Bot(),Top())
@@ -204,6 +522,50 @@ class LinkingTest(unittest.TestCase):
         proofs = list(Linking.enumerate_cyclic_proofs(f))
         self.assertEqual(len(proofs), 1)
 
+    def test_pruned_enumeration(self):
+        f = Parr(Top(), Parr(Tens(Bot(), Bot()), Parr(Top(), Parr(Tens(Bot(), Bot()), Top()))))
+        proofs = [l.links for l in Linking.enumerate_cyclic_proofs(f)]
+        self.assertEqual(proofs,
+            [l.links for l in Linking.enumerate(f) if l.is_cyclic_proof()])
+        self.assertEqual(len(proofs), 3)
+        self.assertEqual(len(list(Linking.enumerate_cyclic_proofs(f, limit=2))), 2)
+        self.assertEqual(len(list(Linking.enumerate(f, limit=5))), 5)
+        planar = [l.links for l in Linking.enumerate(f, planar=True)]
+        self.assertEqual(planar,
+            [l.links for l in Linking.enumerate(f) if l.strongly_planar()])
+
+    def test_neighbour_pairs(self):
+        for formula in Parr.enumerate_normalized(11):
+            proofs = list(Linking.enumerate_symmetric_proofs(formula))
+            self.assertEqual(sorted(Linking.neighbour_pairs(proofs)),
+                [(i, j) for i in range(len(proofs)) for j in range(i)
+                 if proofs[i].is_neighbour(proofs[j])])
+        f = Parr(Top(), Parr(Tens(Bot(), Bot()), Parr(Top(), Parr(Tens(Bot(), Bot()), Top()))))
+        self.assertEqual(Linking.graph_of_equivalences(f), (3, 1))
+
+    def test_sweep(self):
+        import json, os, tempfile
+        records = list(sweep(1, 10))
+        key = lambda record: (record['nodes'], record['index'])
+        self.assertEqual(sorted(map(key, records)), list(map(key, records)))
+        self.assertTrue(all(record['seconds'] >= 0 for record in records))
+        self.assertEqual(sorted(map(key, sweep(1, 10, workers=2))),
+                         list(map(key, records)))
+        for record in records:
+            formula = list(Parr.enumerate_normalized(record['nodes']))[record['index']]
+            self.assertEqual(record['proofs'],
+                             len(list(Linking.enumerate_cyclic_proofs(formula))))
+        self.assertIn(1, [record['proofs'] for record in records])
+        with tempfile.TemporaryDirectory() as path:
+            fname = os.path.join(path, 'sweep.jsonl')
+            sweep_to_file(fname, 1, 8)
+            with open(fname, 'a') as f:
+                f.write('{"nodes": 9')
+            sweep_to_file(fname, 1, 10, resume=True)
+            with open(fname) as f:
+                recorded = [json.loads(line) for line in f]
+            self.assertEqual(list(map(key, recorded)), list(map(key, records)))
+
 
 class SwitchingTest(unittest.TestCase):
     def test_acyclic_and_connected(self):
@@ -238,6 +600,16 @@ class SwitchingTest(unittest.TestCase):
         all_switchings = list(Switching.enumerate(l1))
         self.assertEqual(len(all_switchings), 4)
 
+    def test_sweep(self):
+        for formula in Parr.enumerate_normalized(9):
+            for l in Linking.enumerate(formula):
+                swept = list(Switching.sweep(l))
+                switchings = list(Switching.enumerate(l))
+                self.assertEqual([s.directions for s, _ in swept],
+                                 [s.directions for s in switchings])
+                self.assertEqual([correct for _, correct in swept],
+                                 [s.acyclic_and_connected() for s in switchings])
+
     def test_long_trip(self):
         f = Parr(Tens(Bot(),Bot()),Parr(Top(),Top()))
         l = Linking(f, [(2, 5), (3, 6)])
@@ -265,6 +637,12 @@ class SwitchingTest(unittest.TestCase):
 def load_tests(loader, tests, ignore):
     import doctest
     import diskpartition
+    import linking
+    import switching
+    import unionfind
     tests.addTests(doctest.DocTestSuite(diskpartition))
+    tests.addTests(doctest.DocTestSuite(linking))
+    tests.addTests(doctest.DocTestSuite(switching))
+    tests.addTests(doctest.DocTestSuite(unionfind))
     return tests
 
@@ -0,0 +1,43 @@
+"""
+Disjoint sets of integers, to follow the connected components of graphs
+"""
+
+class UnionFind(object):
+    """
+    A partition of the integers from 0 to size-1 into classes,
+    initially singletons, which can be united.
+
+    >>> classes = UnionFind(4)
+    >>> classes.union(0, 1), classes.union(2, 3), classes.union(1, 0)
+    (True, True, False)
+    >>> classes.find(0) == classes.find(1), classes.find(1) == classes.find(2)
+    (True, False)
+    >>> classes.nb_classes
+    2
+    """
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.nb_classes = size
+
+    def find(self, i):
+        """
+        Returns the representative of the class of i
+        """
+        parent = self.parent
+        while parent[i] != i:
+            # path halving
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Unites the classes of i and j, under the representative of j.
+        Returns False if they already were the same class.
+        """
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return False
+        self.parent[root_i] = root_j
+        self.nb_classes -= 1
+        return True